@@ -8,9 +8,9 @@ class IngestionAgent:
     def __init__(self, name="IngestionAgent"):
         self.name = name  # Agent identifier
 
-    def handle_document(self, file_path, doc_type, trace_id):
+    def handle_document(self, file_path, doc_type, trace_id, output_folder="extracted_data", progress=None):
         # Extract text and images from the document
-        text_path, image_paths = process_file(file_path, doc_type)
+        text_path, image_paths = process_file(file_path, doc_type, output_folder, progress)
 
         # Check if text extraction was successful
         if not text_path or not os.path.exists(text_path):
@@ -1,75 +1,156 @@
 #agents/retreival.py
 # Import required modules for message passing and AI models
 from mcp.message_protocol import MCPMessage
-from sentence_transformers import SentenceTransformer
+from core.embedding_backends import load_embedding_model
+from core.embedding_utils import BatchEncoder
+from core.chunk_store import ChunkStoreWriter, list_footprint
+from core.query_batcher import QueryBatcher
+from core.chunk_metadata import (
+    COLUMN_TYPES, UNIT_KINDS, chunk_citation, iter_chunks_with_metadata,
+    make_search_params, select_chunk_ids, source_format_code,
+)
 import numpy as np
 import faiss
+import os
+
+class DocumentIndex:
+    """Searchable index of one document: FAISS vectors plus their text chunks"""
+
+    def __init__(self, index=None, chunks=None):
+        self.index = index          # FAISS search index (None if the document had no text)
+        self.chunks = chunks if chunks is not None else []  # ChunkStore (or list), position = FAISS id
 
 class RetrievalAgent:
     def __init__(self, name="RetrievalAgent"):
         self.name = name  # Agent identifier
         # Load sentence transformer model for creating embeddings
-        self.model = SentenceTransformer("all-MiniLM-L6-v2")
-        self.index = None  # FAISS search index
-        self.chunks = []   # Store text chunks
+        # (float32, int8 or ONNX depending on EMBEDDING_BACKEND)
+        self.model = load_embedding_model("all-MiniLM-L6-v2")
+        # Length-bucketed (and, for huge jobs, multi-process) chunk encoder
+        self.batch_encoder = BatchEncoder(self.model)
+        # Queries from concurrent requests are encoded together in small batches
+        self.query_batcher = QueryBatcher(self.model)
+        # No index is kept here: every call gets the DocumentIndex it should search
 
     def group_lines(self, lines, group_size=3):
         return [" ".join(lines[i:i+group_size]) for i in range(0, len(lines), group_size)]
 
-    def embed_chunks(self, chunks):
-        return self.model.encode(chunks).astype("float32")
+    def embed_chunks(self, chunks, progress=None):
+        embeddings, stats = self.batch_encoder.encode(chunks, progress)
+        if stats["chunks"]:
+            print(f"🧮 Embedded {stats['chunks']} chunks in {stats['buckets']} buckets "
+                  f"({stats['chunks_per_sec']:.1f} chunks/s)")
+        return embeddings
+
+    def embed_query(self, query):
+        # (1, dim) float32 query embedding, micro-batched with other requests,
+        # plus this query's queue delay / encode time (see QueryBatcher.encode)
+        return self.query_batcher.encode(query)
 
-    def build_index(self, text_path):
-        # Read and clean text lines
-        with open(text_path, "r", encoding="utf-8") as f:
-            lines = [line.strip() for line in f if line.strip()]
+    def create_index(self, text_path, progress=None, store_path=None, source_format=None, document_name=None):
+        """
+        Build a searchable index for one extracted text file
+        Args:
+            text_path: Path to the extracted text
+            progress: Optional callback progress(stage, done, total) for chunks embedded
+            store_path: Directory for the chunk store (defaults to <text_path>.chunks)
+            source_format: Document type (pdf, pptx, csv, ...) recorded per chunk
+            document_name: Document name recorded per chunk (defaults to the text file name)
+        Returns:
+            DocumentIndex (with index=None if there was nothing to index)
+        """
+        # Stream grouped lines straight into a memory-mapped chunk store,
+        # with page/slide/row provenance kept as metadata columns
+        store_path = store_path or os.path.splitext(text_path)[0] + ".chunks"
+        document_name = document_name or os.path.basename(text_path)
+        format_code = source_format_code(source_format)
+        sections = {}  # Section title -> id in the "sections" table
+
+        writer = ChunkStoreWriter(store_path, COLUMN_TYPES)
+        for text, kind, start, end, section in iter_chunks_with_metadata(text_path, source_format or "unknown"):
+            section_id = sections.setdefault(section, len(sections)) if section else -1
+            writer.append(
+                text,
+                document=0,
+                source_format=format_code,
+                unit_kind=UNIT_KINDS.index(kind),
+                unit_start=start,
+                unit_end=end,
+                section=section_id,
+            )
+        chunks = writer.close(tables={"documents": [document_name], "sections": list(sections)})
 
         # Check if we have any text to process
-        if not lines:
+        if len(chunks) == 0:
             print("⚠️ Warning: No text content found in document")
-            self.chunks = []
-            self.index = None
-            return
-
-        # Group lines into chunks and create embeddings
-        self.chunks = self.group_lines(lines)
-        
-        # Check if we have chunks after grouping
-        if not self.chunks:
-            print("⚠️ Warning: No chunks created from text")
-            self.index = None
-            return
-        
-        embeddings = self.embed_chunks(self.chunks)
-        
+            return DocumentIndex()
+
+        # The list of strings only lives while the chunks are being embedded
+        chunk_texts = list(chunks)
+        print(f"💾 Chunk store: {chunks.nbytes:,} bytes vs {list_footprint(chunk_texts):,} bytes as a list of str")
+        embeddings = self.embed_chunks(chunk_texts, progress)
+        del chunk_texts
+
         # Verify embeddings were created successfully
         if embeddings.shape[0] == 0:
             print("⚠️ Warning: Failed to create embeddings")
-            self.index = None
-            return
+            return DocumentIndex(chunks=chunks)
 
         # Create FAISS index for fast similarity search
-        self.index = faiss.IndexFlatL2(embeddings.shape[1])
-        self.index.add(embeddings)
+        index = faiss.IndexFlatL2(embeddings.shape[1])
+        index.add(embeddings)
+        return DocumentIndex(index, chunks)
+
+    def search(self, query, document_index, k=10, filters=None):
+        """
+        Find the chunks closest to the query
+        Args:
+            query: User's question
+            document_index: DocumentIndex to search
+            k: Number of chunks to return
+            filters: Optional metadata filters (see core.chunk_metadata.select_chunk_ids),
+                     applied inside FAISS so only matching vectors are scored
+        Returns:
+            List of (chunk_id, chunk_text) tuples, best match first
+        """
+        return self._search(query, document_index, k, filters)[0]
+
+    def _search(self, query, document_index, k=10, filters=None):
+        # search() plus the query embedding timings (empty if no embedding was needed)
+        index = document_index.index
+        chunks = document_index.chunks
+        if index is None:
+            return [], {}
+
+        # Restrict the search space before scoring
+        params, selector = None, None
+        ids = select_chunk_ids(chunks, filters)
+        if ids is not None:
+            if len(ids) == 0:
+                return [], {}
+            params, selector = make_search_params(ids)
 
-    def retrieve(self, query, k=10):
         # Convert query to embedding
-        query_embedding = self.model.encode([query]).astype("float32")
+        query_embedding, timings = self.embed_query(query)
         # Search for similar chunks
-        D, I = self.index.search(query_embedding, k)
-        # Return the actual text chunks
-        return [self.chunks[i] for i in I[0] if i < len(self.chunks)]
+        D, I = index.search(query_embedding, k, params=params)
+        # Return the actual text chunks (FAISS pads missing results with -1)
+        return [(int(i), chunks[i]) for i in I[0] if 0 <= i < len(chunks)], timings
 
-    def handle_document(self, mcp_message):
-        # Extract information from message
-        text_path = mcp_message.payload["text_path"]
-        query = mcp_message.payload["query"]
-        trace_id = mcp_message.trace_id
+    def retrieve(self, query, document_index, k=10, filters=None):
+        # Text of the best matching chunks
+        return [text for _, text in self.search(query, document_index, k, filters)]
 
-        # Build searchable index and retrieve relevant chunks
-        self.build_index(text_path)
-        results = self.retrieve(query)
+    def handle_query(self, mcp_message, document_index):
+        # Retrieve relevant chunks from an already built index
+        query = mcp_message.payload["query"]
+        filters = mcp_message.payload.get("filters")
+        hits, timings = self._search(query, document_index, filters=filters)
+        results = [text for _, text in hits]
+        citations = [chunk_citation(document_index.chunks, i) for i, _ in hits]
+        return self.build_response(mcp_message.trace_id, query, results, citations, timings)
 
+    def build_response(self, trace_id, query, results, citations=None, query_timings=None):
         # Create response message for LLM agent
         response = MCPMessage(
             sender=self.name,
@@ -78,7 +159,9 @@ class RetrievalAgent:
             trace_id=trace_id,
             payload={
                 "retrieved_context": results,
-                "query": query
+                "citations": citations or [""] * len(results),  # e.g. "p. 12" per chunk
+                "query": query,
+                "query_timings": query_timings or {}  # Queue delay / encode time of the query embedding
             }
         )
         print(f"[{response.sender} ➜ {response.receiver}] {response.to_dict()}")
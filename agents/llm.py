@@ -80,7 +80,8 @@ Answer:
             trace_id=trace_id,
             payload={
                 "answer": answer,
-                "sources": context_chunks  # Include sources for transparency
+                "sources": context_chunks,  # Include sources for transparency
+                "citations": mcp_message.payload.get("citations", [])  # Page/slide/row of each source
             }
         )
 
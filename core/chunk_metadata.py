@@ -0,0 +1,183 @@
+# core/chunk_metadata.py
+# Per-chunk provenance (document, page/slide/row range, section, format) and
+# metadata filters that are pushed down into FAISS as ID selectors.
+import re
+import numpy as np
+import faiss
+
+# Integer codes stored in the ChunkStore columns
+UNIT_KINDS = ["none", "page", "slide", "row", "sheet"]
+SOURCE_FORMATS = ["unknown", "pdf", "docx", "pptx", "csv", "xlsx", "txt", "image"]
+
+# Compact array typecodes for every metadata column
+COLUMN_TYPES = {
+    "document": "i",       # Index into the "documents" table
+    "source_format": "b",  # Index into SOURCE_FORMATS
+    "unit_kind": "b",      # Index into UNIT_KINDS
+    "unit_start": "i",     # First page/slide/row covered by the chunk
+    "unit_end": "i",       # Last page/slide/row covered by the chunk
+    "section": "i",        # Index into the "sections" table (-1 = none)
+}
+
+# Markers written by core/document_parser.py
+UNIT_MARKER = re.compile(r"^--- (Page|Slide|Sheet) (\d+) ---$")
+SECTION_MARKER = re.compile(r"^--- Section: (.+) ---$")
+
+# Filter shortcuts: {"pages": (10, 40)} == {"unit_kind": "page", "range": (10, 40)}
+RANGE_SHORTCUTS = {"pages": "page", "slides": "slide", "rows": "row", "sheets": "sheet"}
+
+
+def source_format_code(doc_type):
+    doc_type = (doc_type or "").lower().lstrip(".")
+    if doc_type in ("jpg", "jpeg", "png"):
+        doc_type = "image"
+    return SOURCE_FORMATS.index(doc_type) if doc_type in SOURCE_FORMATS else 0
+
+
+def iter_chunks_with_metadata(text_path, source_format="unknown", group_size=3):
+    """
+    Group extracted lines into chunks without mixing page/slide markers into the text
+    Chunks never span two pages/slides; CSV lines are numbered as rows (header = row 0).
+    Args:
+        text_path: Path to the extracted text
+        source_format: Document type (pdf, pptx, csv, ...)
+        group_size: Lines per chunk
+    Yields:
+        Tuple: (chunk_text, unit_kind, unit_start, unit_end, section_title or None)
+    """
+    kind = "row" if source_format in ("csv", "xlsx") else "none"
+    unit = 0
+    row = -1
+    section = None
+    group, units = [], []
+
+    def flush():
+        chunk = (" ".join(group), kind, min(units), max(units), section)
+        group.clear()
+        units.clear()
+        return chunk
+
+    with open(text_path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+
+            # Page/slide markers start a new unit (and a new chunk)
+            marker = UNIT_MARKER.match(line)
+            if marker:
+                if group:
+                    yield flush()
+                kind, unit = marker.group(1).lower(), int(marker.group(2))
+                continue
+
+            # Section markers (e.g. DOCX headings) also start a new chunk
+            marker = SECTION_MARKER.match(line)
+            if marker:
+                if group:
+                    yield flush()
+                section = marker.group(1)
+                continue
+
+            if kind == "row":
+                row += 1
+                unit = row
+
+            group.append(line)
+            units.append(unit)
+            if len(group) == group_size:
+                yield flush()
+
+    if group:
+        yield flush()
+
+
+def select_chunk_ids(chunks, filters):
+    """
+    Evaluate metadata filters against the ChunkStore columns
+    Args:
+        chunks: ChunkStore with metadata columns
+        filters: Dict, any of:
+            "document": name or list of names
+            "source_format": e.g. "pdf"
+            "unit_kind": "page" / "slide" / "row" / "sheet"
+            "range": (start, end) inclusive, chunks overlapping it are kept
+            "pages" / "slides" / "rows" / "sheets": (start, end) shortcut for unit_kind + range
+            "section": case-insensitive substring of the section title
+    Returns:
+        int64 numpy array of matching chunk ids, or None when nothing is filtered
+    Raises ValueError for an unknown unit_kind or a malformed range.
+    """
+    if not filters or not getattr(chunks, "columns", None):
+        return None
+
+    mask = np.ones(len(chunks), dtype=bool)
+
+    if filters.get("document") is not None:
+        names = filters["document"]
+        names = [names] if isinstance(names, str) else list(names)
+        documents = chunks.table("documents")
+        codes = [i for i, name in enumerate(documents) if name in names]
+        mask &= np.isin(chunks.column("document"), codes)
+
+    if filters.get("source_format"):
+        mask &= chunks.column("source_format") == source_format_code(filters["source_format"])
+
+    unit_kind = filters.get("unit_kind")
+    unit_range = filters.get("range")
+    for key, kind in RANGE_SHORTCUTS.items():
+        if filters.get(key) is not None:
+            unit_kind, unit_range = kind, filters[key]
+
+    if unit_kind:
+        if unit_kind not in UNIT_KINDS:
+            raise ValueError(f"❌ Unknown unit_kind '{unit_kind}', expected one of: {', '.join(UNIT_KINDS)}")
+        mask &= chunks.column("unit_kind") == UNIT_KINDS.index(unit_kind)
+
+    if unit_range is not None:
+        if not isinstance(unit_range, (tuple, list)) or len(unit_range) != 2:
+            raise ValueError(f"❌ Range filter must be (start, end), got {unit_range!r}")
+        start, end = unit_range
+        mask &= (chunks.column("unit_end") >= start) & (chunks.column("unit_start") <= end)
+
+    if filters.get("section"):
+        needle = filters["section"].lower()
+        codes = [i for i, title in enumerate(chunks.table("sections")) if needle in title.lower()]
+        mask &= np.isin(chunks.column("section"), codes)
+
+    return np.flatnonzero(mask).astype(np.int64)
+
+
+def make_search_params(ids):
+    """
+    Build FAISS search parameters restricted to the given ids
+    Returns:
+        Tuple: (SearchParameters, selector) - keep the selector alive during search
+    """
+    if len(ids) and ids[-1] - ids[0] + 1 == len(ids):
+        # Contiguous ids (e.g. a page range) only need a range check
+        selector = faiss.IDSelectorRange(int(ids[0]), int(ids[-1]) + 1)
+    else:
+        selector = faiss.IDSelectorBatch(len(ids), faiss.swig_ptr(ids))
+    return faiss.SearchParameters(sel=selector), selector
+
+
+def chunk_citation(chunks, i):
+    """
+    Human readable provenance of chunk i, e.g. "p. 12", "pp. 12-13", "slide 4"
+    Returns an empty string when the store has no metadata.
+    """
+    if not getattr(chunks, "columns", None) or not chunks.has_column("unit_kind"):
+        return ""
+
+    kind = UNIT_KINDS[int(chunks.column("unit_kind")[i])]
+    start, end = int(chunks.column("unit_start")[i]), int(chunks.column("unit_end")[i])
+    labels = {"page": ("p.", "pp."), "slide": ("slide", "slides"), "row": ("row", "rows"), "sheet": ("sheet", "sheets")}
+
+    if kind in labels:
+        singular, plural = labels[kind]
+        return f"{singular} {start}" if start == end else f"{plural} {start}-{end}"
+
+    section = int(chunks.column("section")[i])
+    sections = chunks.table("sections")
+    return sections[section] if 0 <= section < len(sections) else ""
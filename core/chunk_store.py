@@ -0,0 +1,263 @@
+# core/chunk_store.py
+# Compact on-disk chunk storage: all chunk text lives in one UTF-8 buffer and
+# an int64 offsets array marks where each chunk starts. Files are written
+# once and memory-mapped on load, so opening a store costs almost nothing and
+# chunk i (= FAISS id i) is a single slice + decode.
+import os
+import sys
+import json
+import mmap
+import time
+import shutil
+from array import array
+import numpy as np
+
+TEXT_FILE = "chunks.bin"       # Concatenated UTF-8 chunk text
+OFFSETS_FILE = "offsets.npy"   # int64 array of len(chunks) + 1 byte offsets
+TABLES_FILE = "tables.json"    # Small string tables referenced by integer columns
+
+
+class ChunkStore:
+    def __init__(self, buffer, offsets, columns=None, path=None, tables=None):
+        """
+        Args:
+            buffer: bytes-like object holding all chunk text (bytes or mmap)
+            offsets: int64 numpy array, chunk i is buffer[offsets[i]:offsets[i+1]]
+            columns: Optional dict of metadata name -> numpy array (one value per chunk)
+            path: Directory the store was loaded from (None for in-memory stores)
+            tables: Optional dict of name -> list of strings (e.g. section titles)
+        """
+        self.buffer = buffer
+        self.offsets = offsets
+        self.columns = columns or {}
+        self.path = path
+        self.tables = tables or {}
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        # O(1) fetch of one chunk by position (FAISS id)
+        n = len(self)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError(f"chunk index {i} out of range")
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        return bytes(self.buffer[start:end]).decode("utf-8")
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def column(self, name):
+        return self.columns[name]
+
+    def has_column(self, name):
+        return name in self.columns
+
+    def table(self, name):
+        return self.tables.get(name, [])
+
+    @property
+    def nbytes(self):
+        # Size of the text buffer, offsets and metadata columns
+        return len(self.buffer) + self.offsets.nbytes + sum(col.nbytes for col in self.columns.values())
+
+    @classmethod
+    def from_chunks(cls, chunks, columns=None):
+        # Build an in-memory store (nothing written to disk)
+        encoded = [chunk.encode("utf-8") for chunk in chunks]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(b) for b in encoded])
+        columns = {name: np.asarray(values) for name, values in (columns or {}).items()}
+        return cls(b"".join(encoded), offsets, columns)
+
+    @classmethod
+    def write(cls, path, chunks, columns=None, tables=None):
+        """
+        Stream chunks to disk and return the memory-mapped store
+        Args:
+            path: Directory for the store files (created if needed)
+            chunks: Iterable of chunk strings (consumed once)
+            columns: Optional dict of metadata name -> sequence with one value per chunk
+            tables: Optional dict of name -> list of strings
+        Returns:
+            ChunkStore opened from disk
+        """
+        writer = ChunkStoreWriter(path)
+        for chunk in chunks:
+            writer.append(chunk)
+        return writer.close(columns, tables)
+
+    @classmethod
+    def open(cls, path):
+        # Memory-map an existing store; pages are only read when chunks are accessed
+        offsets = np.load(os.path.join(path, OFFSETS_FILE), mmap_mode="r")
+        text_path = os.path.join(path, TEXT_FILE)
+        if os.path.getsize(text_path) == 0:
+            buffer = b""  # mmap cannot map an empty file
+        else:
+            with open(text_path, "rb") as f:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        columns = {}
+        num_chunks = len(offsets) - 1
+        for file_name in os.listdir(path):
+            if file_name.startswith("col_") and file_name.endswith(".npy"):
+                values = np.load(os.path.join(path, file_name), mmap_mode="r")
+                if len(values) != num_chunks:
+                    raise ValueError(f"❌ Column '{file_name[4:-4]}' in {path} has {len(values)} values "
+                                     f"for {num_chunks} chunks")
+                columns[file_name[4:-4]] = values
+
+        tables = {}
+        tables_path = os.path.join(path, TABLES_FILE)
+        if os.path.exists(tables_path):
+            with open(tables_path, "r", encoding="utf-8") as f:
+                tables = json.load(f)
+        return cls(buffer, offsets, columns, path, tables)
+
+    def save(self, path):
+        """
+        Copy the store (text, offsets, metadata columns and tables) to another directory
+        Files are replaced, not overwritten in place, so stores still mapped from
+        an older copy at the same path keep reading their own data.
+        Returns:
+            ChunkStore opened from the new location
+        """
+        if self.path is not None and os.path.abspath(self.path) == os.path.abspath(path):
+            return self
+        os.makedirs(path, exist_ok=True)
+        _remove_metadata_files(path)
+
+        def replace(file_name, write):
+            temp_path = os.path.join(path, file_name + ".tmp")
+            write(temp_path)
+            os.replace(temp_path, os.path.join(path, file_name))
+
+        def write_text(temp_path):
+            if self.path is not None:
+                shutil.copyfile(os.path.join(self.path, TEXT_FILE), temp_path)
+            else:
+                with open(temp_path, "wb") as f:
+                    f.write(self.buffer)
+
+        def write_array(values):
+            def write(temp_path):
+                with open(temp_path, "wb") as f:
+                    np.save(f, np.asarray(values))
+            return write
+
+        def write_tables(temp_path):
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(self.tables, f)
+
+        replace(TEXT_FILE, write_text)
+        replace(OFFSETS_FILE, write_array(self.offsets))
+        for name, values in self.columns.items():
+            replace(f"col_{name}.npy", write_array(values))
+        if self.tables:
+            replace(TABLES_FILE, write_tables)
+        return ChunkStore.open(path)
+
+    @staticmethod
+    def exists(path):
+        return os.path.isfile(os.path.join(path, OFFSETS_FILE)) and os.path.isfile(os.path.join(path, TEXT_FILE))
+
+
+def _remove_metadata_files(path):
+    # Delete the metadata columns and tables of a store directory
+    for file_name in os.listdir(path):
+        if file_name == TABLES_FILE or (file_name.startswith("col_") and file_name.endswith(".npy")):
+            os.remove(os.path.join(path, file_name))
+
+
+class ChunkStoreWriter:
+    """
+    Appends chunks (and their integer metadata) to a store on disk one at a time
+    Usage:
+        writer = ChunkStoreWriter(path, column_types={"page": "i"})
+        writer.append("chunk text", page=3)
+        store = writer.close()
+    """
+
+    def __init__(self, path, column_types=None):
+        """
+        Args:
+            path: Directory for the store files (created if needed)
+            column_types: Optional dict of column name -> array typecode ("b", "h", "i", "q");
+                          columns not listed are stored as int64
+        """
+        os.makedirs(path, exist_ok=True)
+        # Rewriting a store in place: drop files of the previous version so
+        # stale metadata columns / tables are never picked up by open()
+        _remove_metadata_files(path)
+        self.path = path
+        self.text_file = open(os.path.join(path, TEXT_FILE), "wb")
+        self.offsets = array("q", [0])
+        self.column_types = column_types or {}
+        self.columns = {}  # name -> compact array of values
+
+    def append(self, chunk, **metadata):
+        data = chunk.encode("utf-8")
+        self.text_file.write(data)
+        self.offsets.append(self.offsets[-1] + len(data))
+        for name, value in metadata.items():
+            if name not in self.columns:
+                self.columns[name] = array(self.column_types.get(name, "q"))
+            self.columns[name].append(value)
+
+    def close(self, columns=None, tables=None):
+        """
+        Finish writing and return the memory-mapped store
+        Args:
+            columns: Extra dict of name -> sequence with one value per chunk
+            tables: Optional dict of name -> list of strings
+        """
+        self.text_file.close()
+        num_chunks = len(self.offsets) - 1
+        np.save(os.path.join(self.path, OFFSETS_FILE), np.frombuffer(self.offsets, dtype=np.int64))
+
+        # One .npy file per metadata column
+        all_columns = dict(self.columns)
+        all_columns.update(columns or {})
+        for name, values in all_columns.items():
+            values = np.asarray(values)
+            if len(values) != num_chunks:
+                raise ValueError(f"❌ Column '{name}' has {len(values)} values for {num_chunks} chunks")
+            np.save(os.path.join(self.path, f"col_{name}.npy"), values)
+
+        if tables:
+            with open(os.path.join(self.path, TABLES_FILE), "w", encoding="utf-8") as f:
+                json.dump(tables, f)
+
+        return ChunkStore.open(self.path)
+
+
+def list_footprint(chunks):
+    # Bytes used by a Python list of str (list object + every string object)
+    return sys.getsizeof(chunks) + sum(sys.getsizeof(chunk) for chunk in chunks)
+
+
+def measure_footprint(chunks, path=None):
+    """
+    Compare a list-of-strings with the equivalent ChunkStore
+    Args:
+        chunks: List of chunk strings
+        path: Optional directory of an already written store (to time open())
+    Returns:
+        Dictionary with both sizes in bytes, the ratio and (optionally) open time
+    """
+    store = ChunkStore.from_chunks(chunks)
+    report = {
+        "chunks": len(chunks),
+        "list_bytes": list_footprint(chunks),
+        "store_bytes": store.nbytes,
+    }
+    report["ratio"] = report["list_bytes"] / report["store_bytes"] if report["store_bytes"] else float("inf")
+    if path:
+        start = time.time()
+        ChunkStore.open(path)
+        report["open_seconds"] = time.time() - start
+    return report
@@ -9,11 +9,35 @@ from io import BytesIO    # For handling image bytes
 import pytesseract        # For OCR (Optical Character Recognition)
 import fitz               # PyMuPDF - for PDF image extraction
 import shutil             # For file/folder operations
+import zipfile            # DOCX/PPTX are zip containers with a media folder
+from xml.etree import ElementTree  # For reading [Content_Types].xml inside DOCX/PPTX
+import hashlib            # For de-duplicating identical images
+import time               # For image extraction throughput
 
-def process_file(file_path, document_type):
+# Images smaller than this are treated as decorative and skipped (0 = keep all)
+IMAGE_MIN_SIDE = int(os.getenv("IMAGE_MIN_SIDE", "0"))     # Shortest side in pixels
+IMAGE_MIN_BYTES = int(os.getenv("IMAGE_MIN_BYTES", "0"))   # Encoded size in bytes
+
+# PDF image filters whose raw stream already is a complete image file
+PASSTHROUGH_FILTERS = {"DCTDecode": "jpg", "JPXDecode": "jp2"}
+
+# Media parts of DOCX/PPTX files that are pictures (the same folders also hold audio/video)
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".jpe", ".gif", ".bmp", ".tif", ".tiff",
+                    ".emf", ".wmf", ".svg", ".webp", ".jfif"}
+
+def process_file(file_path, document_type, output_folder="extracted_data", progress=None):
+    """
+    Extract text (and images) from a document
+    Args:
+        file_path: Path to the document
+        document_type: Type of document (pdf, docx, etc.)
+        output_folder: Folder for extracted text/images (wiped before use)
+        progress: Optional callback progress(stage, done, total) for pages parsed
+    Returns:
+        Tuple: (text_file_path, list_of_image_paths)
+    """
     # Get file extension to determine processing method
     ext = os.path.splitext(file_path)[-1].lower()
-    output_folder = "extracted_data"
 
     # Clean up old extracted data to avoid confusion
     if os.path.exists(output_folder):
@@ -26,9 +50,9 @@ def process_file(file_path, document_type):
 
     # Route to appropriate extraction function based on file type
     if ext == ".pdf":
-        extracted_images = extract_text_and_images_from_pdf(file_path, txt_file_path, output_folder)
+        extracted_images = extract_text_and_images_from_pdf(file_path, txt_file_path, output_folder, progress)
     elif ext in [".pptx"]:
-        extracted_images = extract_text_and_images_from_pptx(file_path, txt_file_path, output_folder)
+        extracted_images = extract_text_and_images_from_pptx(file_path, txt_file_path, output_folder, progress)
     elif ext == ".csv":
         extracted_images = extract_text_from_csv(file_path, txt_file_path)
     elif ext == ".docx":
@@ -39,59 +63,183 @@ def process_file(file_path, document_type):
         # Unsupported file type
         return None, []
 
+    # Single-unit formats report as one parsed page
+    if progress and ext not in [".pdf", ".pptx"]:
+        progress("parsing", 1, 1)
+
     return txt_file_path, extracted_images
 
-def extract_text_and_images_from_pdf(pdf_path, txt_file_path, output_folder):
+def extract_text_and_images_from_pdf(pdf_path, txt_file_path, output_folder, progress=None,
+                                     min_side=IMAGE_MIN_SIDE, min_bytes=IMAGE_MIN_BYTES):
     all_text = []           # Store text from all pages
     extracted_images = []   # Store image file paths
     
     # Extract text using pdfplumber (better for text extraction)
     with pdfplumber.open(pdf_path) as pdf:
+        total_pages = len(pdf.pages)
         for i, page in enumerate(pdf.pages):
             text = page.extract_text()  # Extract text from current page
             if text:
                 # Add page marker for better organization
                 all_text.append(f"--- Page {i+1} ---\n{text}")
+            if progress:
+                progress("parsing", i + 1, total_pages)
 
     # Save all extracted text to file
     with open(txt_file_path, "w", encoding="utf-8") as f:
         f.write("\n\n".join(all_text))
 
     # Extract images using PyMuPDF (better for image extraction)
+    # JPEG / JPEG 2000 streams are written as-is (no decode / re-encode). Other
+    # filters (e.g. FlateDecode screenshots and diagrams) hold raw pixel data that
+    # is not a file format on its own, so PyMuPDF still decodes them to PNG.
     try:
-        doc = fitz.open(pdf_path)
-        for i, page in enumerate(doc):
-            # Get all images from current page
-            for img_index, img in enumerate(page.get_images(full=True)):
-                xref = img[0]  # Image reference number
-                base_image = doc.extract_image(xref)  # Extract image data
-                image_bytes = base_image["image"]     # Get image bytes
-                
-                # Convert bytes to PIL Image
-                image = Image.open(BytesIO(image_bytes))
-                
-                # Create descriptive filename
-                img_path = os.path.join(output_folder, f"{os.path.basename(pdf_path)}_p{i+1}_img{img_index+1}.png")
-                image.save(img_path)  # Save image file
-                extracted_images.append(img_path)  # Add to list
+        stats = _new_image_stats()
+        seen_xrefs = set()    # Same image object referenced on several pages
+        seen_hashes = set()   # Same bytes stored under different objects
+        with fitz.open(pdf_path) as doc:
+            for i, page in enumerate(doc):
+                # Get all images from current page
+                for img_index, img in enumerate(page.get_images(full=True)):
+                    xref, width, height = img[0], img[2], img[3]  # Reference number and pixel size
+                    image_filter = img[8]                          # Stream compression, e.g. DCTDecode
+                    if xref in seen_xrefs:
+                        stats["duplicates"] += 1
+                        continue
+                    seen_xrefs.add(xref)
+
+                    # Size filter uses the PDF metadata, before touching the stream
+                    if min_side and min(width, height) < min_side:
+                        stats["skipped_small"] += 1
+                        continue
+
+                    if image_filter in PASSTHROUGH_FILTERS:
+                        # Original encoded bytes straight from the xref stream
+                        image_bytes, ext = doc.xref_stream_raw(xref), PASSTHROUGH_FILTERS[image_filter]
+                    else:
+                        base_image = doc.extract_image(xref)  # Decoded and saved as PNG by PyMuPDF
+                        image_bytes, ext = base_image["image"], base_image["ext"]
+                    img_name = f"{os.path.basename(pdf_path)}_p{i+1}_img{img_index+1}.{ext}"
+                    img_path = _save_image_bytes(image_bytes, img_name, output_folder,
+                                                 seen_hashes, stats, min_bytes=min_bytes)
+                    if img_path:
+                        extracted_images.append(img_path)  # Add to list
+        _report_image_throughput(pdf_path, stats)
     except Exception as e:
         print(f"Image extraction failed: {e}")
 
     return extracted_images
 
-def extract_text_and_images_from_docx(docx_path, txt_file_path, output_folder):
+def _new_image_stats():
+    return {"images": 0, "bytes": 0, "duplicates": 0, "skipped_small": 0, "start": time.time()}
+
+def _save_image_bytes(image_bytes, img_name, output_folder, seen_hashes, stats, min_side=0, min_bytes=0):
+    """
+    Write encoded image bytes to disk unless they are a duplicate or too small
+    Returns:
+        Path of the written image, or None if it was skipped
+    """
+    # De-duplicate by content
+    digest = hashlib.sha1(image_bytes).hexdigest()
+    if digest in seen_hashes:
+        stats["duplicates"] += 1
+        return None
+    seen_hashes.add(digest)
+
+    if min_bytes and len(image_bytes) < min_bytes:
+        stats["skipped_small"] += 1
+        return None
+    if min_side:
+        # PIL only reads the header here; pixel data is never decoded
+        try:
+            width, height = Image.open(BytesIO(image_bytes)).size
+        except Exception:
+            width = height = min_side  # Unknown format (e.g. EMF): keep it
+        if min(width, height) < min_side:
+            stats["skipped_small"] += 1
+            return None
+
+    img_path = os.path.join(output_folder, img_name)
+    with open(img_path, "wb") as f:
+        f.write(image_bytes)
+    stats["images"] += 1
+    stats["bytes"] += len(image_bytes)
+    return img_path
+
+def _zip_content_types(archive):
+    # Content type of every part, from [Content_Types].xml (defaults per extension + overrides)
+    defaults, overrides = {}, {}
+    try:
+        root = ElementTree.fromstring(archive.read("[Content_Types].xml"))
+    except (KeyError, ElementTree.ParseError):
+        return defaults, overrides
+    for element in root:
+        tag = element.tag.rsplit("}", 1)[-1]
+        if tag == "Default":
+            defaults[element.get("Extension", "").lower()] = element.get("ContentType", "")
+        elif tag == "Override":
+            overrides[element.get("PartName", "").lstrip("/")] = element.get("ContentType", "")
+    return defaults, overrides
+
+def _is_image_part(name, content_types):
+    # Trust the declared content type, fall back to the file extension
+    defaults, overrides = content_types
+    ext = os.path.splitext(name)[-1].lower()
+    content_type = overrides.get(name) or defaults.get(ext.lstrip("."))
+    if content_type:
+        return content_type.startswith("image/")
+    return ext in IMAGE_EXTENSIONS
+
+def _extract_media_from_zip(container_path, media_prefix, output_folder, min_side=0, min_bytes=0):
+    # DOCX/PPTX keep their pictures as media parts inside the zip container
+    extracted_images = []
+    stats = _new_image_stats()
+    seen_hashes = set()
+    with zipfile.ZipFile(container_path) as archive:
+        content_types = _zip_content_types(archive)
+        media_names = [n for n in archive.namelist() if n.startswith(media_prefix) and not n.endswith("/")
+                       and _is_image_part(n, content_types)]
+        for img_index, name in enumerate(media_names):
+            ext = os.path.splitext(name)[-1].lower()
+            img_name = f"{os.path.basename(container_path)}_img{img_index+1}{ext}"
+            img_path = _save_image_bytes(archive.read(name), img_name, output_folder,
+                                         seen_hashes, stats, min_side, min_bytes)
+            if img_path:
+                extracted_images.append(img_path)
+    _report_image_throughput(container_path, stats)
+    return extracted_images
+
+def _report_image_throughput(source_path, stats):
+    elapsed = max(time.time() - stats["start"], 1e-9)
+    print(f"🖼️ Extracted {stats['images']} images from {os.path.basename(source_path)} "
+          f"({stats['images'] / elapsed:.1f} images/s, {stats['bytes'] / elapsed / 1e6:.1f} MB/s, "
+          f"{stats['duplicates']} duplicates, {stats['skipped_small']} too small)")
+
+def extract_text_and_images_from_docx(docx_path, txt_file_path, output_folder,
+                                      min_side=IMAGE_MIN_SIDE, min_bytes=IMAGE_MIN_BYTES):
     # Load Word document
     doc = docx.Document(docx_path)
     
     # Extract text from all paragraphs (skip empty ones)
-    all_text = [para.text for para in doc.paragraphs if para.text.strip()]
+    all_text = []
+    for para in doc.paragraphs:
+        if not para.text.strip():
+            continue
+        # Mark headings so chunks can record which section they belong to
+        if para.style is not None and para.style.name.startswith("Heading"):
+            all_text.append(f"--- Section: {para.text.strip()} ---")
+        all_text.append(para.text)
 
     # Save extracted text to file
     with open(txt_file_path, "w", encoding="utf-8") as f:
         f.write("\n".join(all_text))
 
-    # TODO: Add image extraction from DOCX files
-    return []
+    # Copy embedded pictures straight from the word/media parts
+    try:
+        return _extract_media_from_zip(docx_path, "word/media/", output_folder, min_side, min_bytes)
+    except Exception as e:
+        print(f"Image extraction failed: {e}")
+        return []
 
 def extract_text_from_csv(csv_path, txt_file_path):
     try:
@@ -108,24 +256,34 @@ def extract_text_from_csv(csv_path, txt_file_path):
     print(f"Extracted text from CSV: {txt_file_path}")
     return []  # No images in CSV files
 
-def extract_text_and_images_from_pptx(pptx_path, txt_file_path, output_folder):
+def extract_text_and_images_from_pptx(pptx_path, txt_file_path, output_folder, progress=None,
+                                      min_side=IMAGE_MIN_SIDE, min_bytes=IMAGE_MIN_BYTES):
     presentation = Presentation(pptx_path)
     full_text = []
+    total_slides = len(presentation.slides)
     
     # Loop through all slides in presentation
     for i, slide in enumerate(presentation.slides):
+        # Add slide marker so chunks keep their slide number
+        full_text.append(f"--- Slide {i+1} ---")
         # Loop through all shapes in slide (text boxes, etc.)
         for shape in slide.shapes:
             # Check if shape contains text
             if hasattr(shape, "text"):
                 full_text.append(shape.text)
+        if progress:
+            progress("parsing", i + 1, total_slides)
 
     # Save all extracted text to file
     with open(txt_file_path, "w", encoding="utf-8") as f:
         f.write("\n".join(full_text))
 
-    # TODO: Add image extraction from PPTX files
-    return []
+    # Copy embedded pictures straight from the ppt/media parts
+    try:
+        return _extract_media_from_zip(pptx_path, "ppt/media/", output_folder, min_side, min_bytes)
+    except Exception as e:
+        print(f"Image extraction failed: {e}")
+        return []
 
 def extract_text_from_image(image_path, txt_file_path):
     # Load image and convert to grayscale (better for OCR)
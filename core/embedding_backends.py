@@ -0,0 +1,300 @@
+# core/embedding_backends.py
+# Optional accelerated CPU encoders for the sentence embedding model.
+#
+# Select the backend with the EMBEDDING_BACKEND environment variable:
+#   float32    - plain SentenceTransformer (default)
+#   int8       - dynamic int8 quantization of the transformer's Linear layers
+#   onnx       - exported ONNX graph run with onnxruntime on CPU
+#   onnx-int8  - ONNX graph with int8 dynamically quantized weights
+#
+# Check the quality cost before switching:
+#   python -m core.embedding_backends int8
+
+import os
+import sys
+import time
+import numpy as np
+import torch
+from sentence_transformers import SentenceTransformer
+from sentence_transformers.models import Normalize, Pooling
+
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "float32")
+SUPPORTED_BACKENDS = ["float32", "int8", "onnx", "onnx-int8"]
+
+# Exported ONNX graphs are cached here so they are only built once
+ONNX_CACHE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "models", "onnx"))
+
+# Small fixed corpus used by the built-in quality check
+REFERENCE_CORPUS = [
+    "The quarterly revenue increased by 12 percent compared to last year.",
+    "Operating costs were reduced through automation of the billing process.",
+    "The new warehouse in Chennai will open in the second half of the year.",
+    "Employees can claim travel expenses through the internal portal.",
+    "The model was trained on 50,000 labelled customer support tickets.",
+    "Accuracy on the held-out test set reached 91 percent.",
+    "Precision and recall were computed for every intent class.",
+    "The chatbot answers questions about uploaded PDF and Word documents.",
+    "Documents are split into chunks and embedded with a sentence transformer.",
+    "A FAISS index is used to find the chunks closest to the question.",
+    "The final answer is generated by a large language model.",
+    "Photosynthesis converts light energy into chemical energy in plants.",
+    "The mitochondria is the powerhouse of the cell.",
+    "Water boils at 100 degrees Celsius at sea level.",
+    "The Eiffel Tower is located in Paris and was completed in 1889.",
+    "Mount Everest is the highest mountain above sea level.",
+    "The football match was postponed because of heavy rain.",
+    "She won the chess tournament after a long endgame.",
+    "Add two cups of flour and stir until the batter is smooth.",
+    "Preheat the oven to 180 degrees before baking the cake.",
+    "The patient was prescribed antibiotics for a bacterial infection.",
+    "Regular exercise lowers the risk of heart disease.",
+    "The contract can be terminated with thirty days written notice.",
+    "All personal data is stored in encrypted form.",
+]
+
+REFERENCE_QUERIES = [
+    "How much did revenue grow?",
+    "What accuracy did the model achieve?",
+    "How does the system search for relevant text?",
+    "Which language model writes the answer?",
+    "How do plants make energy?",
+    "Where is the Eiffel Tower?",
+    "How do I bake a cake?",
+    "How can the agreement be cancelled?",
+]
+
+
+def load_embedding_model(model_name="all-MiniLM-L6-v2", backend=None):
+    """
+    Load the embedding model with the configured backend
+    Args:
+        model_name: Sentence transformer model name
+        backend: One of SUPPORTED_BACKENDS (defaults to EMBEDDING_BACKEND)
+    Returns:
+        Object exposing the SentenceTransformer encode() API
+    """
+    backend = (backend or EMBEDDING_BACKEND).lower()
+    if backend not in SUPPORTED_BACKENDS:
+        raise ValueError(f"❌ Unsupported embedding backend: {backend} (choose from {SUPPORTED_BACKENDS})")
+
+    if backend == "float32":
+        return SentenceTransformer(model_name)
+
+    # Accelerated backends are CPU-only
+    model = SentenceTransformer(model_name, device="cpu")
+    if backend == "int8":
+        return quantize_int8(model)
+    return OnnxEncoder(model, model_name, quantize=(backend == "onnx-int8"))
+
+
+def quantize_int8(model):
+    # Replace every Linear layer with a dynamically quantized int8 version
+    quantized = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    quantized.embedding_backend = "int8"
+    return quantized
+
+
+class _TokenEmbeddings(torch.nn.Module):
+    # Wraps the Hugging Face transformer so the exported graph has one output
+    def __init__(self, transformer, input_names):
+        super().__init__()
+        self.transformer = transformer
+        self.input_names = input_names
+
+    def forward(self, *inputs):
+        return self.transformer(**dict(zip(self.input_names, inputs)))[0]
+
+
+def export_onnx(model, model_name, cache_dir=ONNX_CACHE_DIR):
+    """
+    Export the transformer of a SentenceTransformer to ONNX (cached on disk)
+    Returns:
+        Path to the .onnx file
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    onnx_path = os.path.join(cache_dir, f"{model_name.replace('/', '_')}.onnx")
+    if os.path.exists(onnx_path):
+        return onnx_path
+
+    dummy = model.tokenizer(["An example sentence for export."], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in dummy]
+    wrapper = _TokenEmbeddings(model[0].auto_model.eval(), input_names)
+
+    # Batch size and sequence length stay dynamic
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["token_embeddings"] = {0: "batch", 1: "sequence"}
+
+    with torch.no_grad():
+        torch.onnx.export(
+            wrapper,
+            tuple(dummy[name] for name in input_names),
+            onnx_path,
+            input_names=input_names,
+            output_names=["token_embeddings"],
+            dynamic_axes=dynamic_axes,
+            opset_version=14,
+        )
+    print(f"✅ Exported ONNX embedding model to {onnx_path}")
+    return onnx_path
+
+
+def quantize_onnx(onnx_path):
+    # Dynamic int8 weight quantization of an exported graph (cached on disk)
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantized_path = onnx_path.replace(".onnx", ".int8.onnx")
+    if not os.path.exists(quantized_path):
+        quantize_dynamic(onnx_path, quantized_path, weight_type=QuantType.QInt8)
+    return quantized_path
+
+
+class OnnxEncoder:
+    """
+    Runs the exported transformer with onnxruntime and applies the same
+    pooling / normalization as the original SentenceTransformer
+    """
+
+    def __init__(self, model, model_name, quantize=False, cache_dir=ONNX_CACHE_DIR):
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise ImportError("❌ onnxruntime is required for the ONNX embedding backend: pip install onnxruntime")
+
+        self.embedding_backend = "onnx-int8" if quantize else "onnx"
+        self.tokenizer = model.tokenizer
+        self.max_seq_length = model.max_seq_length
+        self.dimension = model.get_sentence_embedding_dimension()
+
+        # Copy pooling settings from the original model
+        self.pooling_mode = "mean"
+        self.normalize = False
+        for module in model:
+            if isinstance(module, Pooling):
+                if module.pooling_mode_cls_token:
+                    self.pooling_mode = "cls"
+                elif module.pooling_mode_max_tokens:
+                    self.pooling_mode = "max"
+            if isinstance(module, Normalize):
+                self.normalize = True
+
+        onnx_path = export_onnx(model, model_name, cache_dir)
+        if quantize:
+            onnx_path = quantize_onnx(onnx_path)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = [node.name for node in self.session.get_inputs()]
+
+    def get_sentence_embedding_dimension(self):
+        return self.dimension
+
+    def pool(self, token_embeddings, attention_mask):
+        if self.pooling_mode == "cls":
+            return token_embeddings[:, 0]
+        mask = attention_mask[..., None].astype(token_embeddings.dtype)
+        if self.pooling_mode == "max":
+            return np.where(mask > 0, token_embeddings, -1e9).max(axis=1)
+        return (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+    def encode(self, sentences, batch_size=32, **kwargs):
+        """
+        Encode sentences like SentenceTransformer.encode (numpy output)
+        Extra keyword arguments are accepted for compatibility and ignored.
+        """
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+        sentences = list(sentences)
+        if not sentences:
+            return np.zeros((0, self.dimension), dtype="float32")
+
+        outputs = []
+        for start in range(0, len(sentences), batch_size):
+            batch = sentences[start:start + batch_size]
+            features = self.tokenizer(
+                batch,
+                padding=True,
+                truncation=True,
+                max_length=self.max_seq_length,
+                return_tensors="np",
+            )
+            inputs = {name: features[name].astype("int64") for name in self.input_names}
+            token_embeddings = self.session.run(None, inputs)[0]
+            embeddings = self.pool(token_embeddings, features["attention_mask"])
+            if self.normalize:
+                embeddings = embeddings / np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+            outputs.append(embeddings.astype("float32"))
+
+        embeddings = np.vstack(outputs)
+        return embeddings[0] if single else embeddings
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype="float32")
+    return vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+
+
+def _timed_encode(model, texts, repeats):
+    # Best-of-N wall time so a cold first call does not skew the comparison
+    best = float("inf")
+    embeddings = None
+    for _ in range(repeats):
+        start = time.time()
+        embeddings = model.encode(texts)
+        best = min(best, time.time() - start)
+    return np.asarray(embeddings, dtype="float32"), best
+
+
+def compare_backends(reference_model, candidate_model, corpus=None, queries=None, k=3, repeats=3):
+    """
+    Compare a candidate backend with the float32 reference model
+    Args:
+        reference_model: float32 SentenceTransformer
+        candidate_model: Accelerated encoder to evaluate
+        corpus / queries: Texts to compare on (defaults to the built-in fixed set)
+        k: Cut-off used for retrieval recall
+        repeats: Timing repetitions (best run is reported)
+    Returns:
+        Dictionary with cosine agreement, recall@k and throughput of both models
+    """
+    corpus = corpus or REFERENCE_CORPUS
+    queries = queries or REFERENCE_QUERIES
+    k = min(k, len(corpus))
+
+    ref_corpus, ref_time = _timed_encode(reference_model, corpus, repeats)
+    cand_corpus, cand_time = _timed_encode(candidate_model, corpus, repeats)
+    ref_corpus, cand_corpus = _normalize(ref_corpus), _normalize(cand_corpus)
+
+    # Cosine similarity between the two embeddings of the same text
+    cosines = (ref_corpus * cand_corpus).sum(axis=1)
+
+    # Retrieval recall: how many of the reference top-k the candidate also finds
+    ref_queries = _normalize(reference_model.encode(queries))
+    cand_queries = _normalize(candidate_model.encode(queries))
+    ref_top = np.argsort(-(ref_queries @ ref_corpus.T), axis=1)[:, :k]
+    cand_top = np.argsort(-(cand_queries @ cand_corpus.T), axis=1)[:, :k]
+    recall = np.mean([len(set(r) & set(c)) / k for r, c in zip(ref_top, cand_top)])
+
+    report = {
+        "backend": getattr(candidate_model, "embedding_backend", "float32"),
+        "cosine_mean": float(cosines.mean()),
+        "cosine_min": float(cosines.min()),
+        f"recall_at_{k}": float(recall),
+        "reference_texts_per_sec": len(corpus) / ref_time if ref_time > 0 else float("inf"),
+        "candidate_texts_per_sec": len(corpus) / cand_time if cand_time > 0 else float("inf"),
+        "speedup": ref_time / cand_time if cand_time > 0 else float("inf"),
+    }
+    return report
+
+
+if __name__ == "__main__":
+    # Usage: python -m core.embedding_backends [int8|onnx|onnx-int8]
+    backend = sys.argv[1] if len(sys.argv) > 1 else "int8"
+    reference = load_embedding_model(backend="float32")
+    candidate = load_embedding_model(backend=backend)
+    results = compare_backends(reference, candidate)
+
+    print(f"\n📊 Embedding backend check: {backend} vs float32")
+    for key, value in results.items():
+        print(f"  {key}: {value:.4f}" if isinstance(value, float) else f"  {key}: {value}")
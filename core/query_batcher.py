@@ -0,0 +1,125 @@
+# core/query_batcher.py
+# Dynamic micro-batching of query embeddings across concurrent requests.
+#
+# Each request hands its query to one background thread, which waits a few
+# milliseconds (or until the batch is full) for other queries to arrive and
+# encodes them together in one model.encode() call.
+#
+# Configuration:
+#   QUERY_BATCH_WAIT_MS=2     how long the first query of a batch may wait
+#   QUERY_BATCH_MAX_SIZE=32   flush as soon as this many queries are queued
+import os
+import time
+import queue
+import threading
+from collections import Counter, deque
+from concurrent.futures import Future
+
+import numpy as np
+
+QUERY_BATCH_WAIT_MS = float(os.getenv("QUERY_BATCH_WAIT_MS", "2"))
+QUERY_BATCH_MAX_SIZE = int(os.getenv("QUERY_BATCH_MAX_SIZE", "32"))
+
+
+class QueryBatcher:
+    def __init__(self, model, max_batch_size=None, max_wait_ms=None, metrics_window=10000):
+        """
+        Args:
+            model: Object with the SentenceTransformer encode() API
+            max_batch_size: Largest batch sent to the model
+            max_wait_ms: Longest time the oldest query waits for company
+            metrics_window: Number of recent queries kept for latency percentiles
+        """
+        self.model = model
+        self.max_batch_size = max_batch_size or QUERY_BATCH_MAX_SIZE
+        self.max_wait = (QUERY_BATCH_WAIT_MS if max_wait_ms is None else max_wait_ms) / 1000.0
+        self.queue = queue.Queue()
+
+        # Metrics
+        self.lock = threading.Lock()
+        self.batches = 0
+        self.queries = 0
+        self.batch_sizes = Counter()                         # batch size -> number of batches
+        self.queue_delays = deque(maxlen=metrics_window)     # seconds from submit to encode start
+        self.encode_times = deque(maxlen=metrics_window)     # seconds per model.encode() call
+
+        self.worker = threading.Thread(target=self._run, name="query-batcher", daemon=True)
+        self.worker.start()
+
+    def encode(self, query, timeout=None):
+        """
+        Encode one query (blocks until its batch has been encoded)
+        The work happens on the batcher thread, so the caller's own profiler only
+        sees it waiting; the returned timings say where that time went.
+        Returns:
+            Tuple: (float32 array of shape (1, dim), timings)
+            timings: queue_delay and encode_time in seconds, batch_size
+        """
+        future = Future()
+        self.queue.put((query, time.time(), future))
+        return future.result(timeout=timeout)
+
+    def _collect_batch(self, first):
+        # Gather more queries until the batch is full or the oldest one has waited long enough
+        batch = [first]
+        deadline = first[1] + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.time()
+            try:
+                item = self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self.queue.put(None)  # Let the main loop see the stop signal
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            first = self.queue.get()
+            if first is None:
+                break
+            batch = self._collect_batch(first)
+
+            start = time.time()
+            try:
+                vectors = np.asarray(self.model.encode([q for q, _, _ in batch], batch_size=len(batch)),
+                                     dtype="float32")
+            except Exception as e:
+                for _, _, future in batch:
+                    future.set_exception(e)
+                continue
+            encode_time = time.time() - start
+
+            # Hand every caller its own row and how long it queued / was encoded
+            for i, (_, submitted, future) in enumerate(batch):
+                timings = {"queue_delay": start - submitted, "encode_time": encode_time, "batch_size": len(batch)}
+                future.set_result((vectors[i:i + 1], timings))
+
+            with self.lock:
+                self.batches += 1
+                self.queries += len(batch)
+                self.batch_sizes[len(batch)] += 1
+                self.queue_delays.extend(start - submitted for _, submitted, _ in batch)
+                self.encode_times.append(encode_time)
+
+    def stats(self):
+        """Batch size and queueing delay metrics"""
+        with self.lock:
+            delays = np.array(self.queue_delays) * 1000 if self.queue_delays else np.zeros(1)
+            return {
+                "batches": self.batches,
+                "queries": self.queries,
+                "mean_batch_size": self.queries / self.batches if self.batches else 0.0,
+                "batch_size_histogram": dict(sorted(self.batch_sizes.items())),
+                "queue_delay_p50_ms": float(np.percentile(delays, 50)),
+                "queue_delay_p99_ms": float(np.percentile(delays, 99)),
+                "encode_ms_mean": float(np.mean(self.encode_times) * 1000) if self.encode_times else 0.0,
+                "max_wait_ms": self.max_wait * 1000,
+                "max_batch_size": self.max_batch_size,
+            }
+
+    def close(self):
+        self.queue.put(None)
+        self.worker.join(timeout=1.0)
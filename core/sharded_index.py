@@ -0,0 +1,365 @@
+# core/sharded_index.py
+# Corpus-wide vector index split across local worker processes.
+#
+# Every document is placed on one shard by hashing its key, each shard is a
+# separate process holding its own FAISS index, and a query is scattered to
+# all shards and merged into one global top-k. A shard that does not answer
+# within the timeout is skipped (the result is marked partial).
+#
+# Benchmark on one Linux box:
+#   python -m core.sharded_index 1 2 4
+import os
+import sys
+import time
+import bisect
+import hashlib
+import threading
+import multiprocessing as mp
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+import numpy as np
+import faiss
+
+
+def _shard_worker(conn, dim, threads):
+    # Runs in the shard process: owns one FAISS index and answers requests in order
+    faiss.omp_set_num_threads(threads)
+    index = faiss.IndexIDMap2(faiss.IndexFlatL2(dim))
+    while True:
+        try:
+            op, seq, args = conn.recv()
+        except EOFError:
+            break
+        try:
+            if op == "add":
+                ids, vectors = args
+                index.add_with_ids(vectors, ids)
+                result = index.ntotal
+            elif op == "search":
+                queries, k = args
+                result = index.search(queries, k) if index.ntotal else None
+            elif op == "remove":
+                ids = args
+                result = index.remove_ids(faiss.IDSelectorBatch(len(ids), faiss.swig_ptr(ids)))
+            elif op == "size":
+                result = index.ntotal
+            elif op == "close":
+                conn.send((seq, "ok", None))
+                break
+            else:
+                raise ValueError(f"Unknown shard operation: {op}")
+            conn.send((seq, "ok", result))
+        except Exception as e:
+            conn.send((seq, "error", str(e)))
+    conn.close()
+
+
+class _ShardClient:
+    """Parent-side handle of one shard process (thread safe)"""
+
+    def __init__(self, ctx, shard_id, dim, threads):
+        self.shard_id = shard_id
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_shard_worker, args=(child_conn, dim, threads),
+                                   name=f"faiss-shard-{shard_id}", daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.send_lock = threading.Lock()
+        self.pending = {}               # seq -> Future waiting for the reply
+        self.pending_lock = threading.Lock()
+        self.seq = 0
+        self.alive = True               # False once the shard process / pipe is gone
+        # One reader thread per shard resolves replies, so many callers can share a shard
+        self.reader = threading.Thread(target=self._read_loop, name=f"faiss-shard-reader-{shard_id}", daemon=True)
+        self.reader.start()
+
+    def request(self, op, args=None):
+        # Always returns a Future; a dead shard fails it with RuntimeError instead of raising
+        future = Future()
+        with self.pending_lock:
+            if not self.alive:
+                future.set_exception(RuntimeError(f"Shard {self.shard_id} stopped"))
+                return future
+            self.seq += 1
+            seq = self.seq
+            self.pending[seq] = future
+        try:
+            with self.send_lock:
+                self.conn.send((op, seq, args))
+        except (OSError, ValueError) as e:
+            # Broken pipe / closed connection: the shard process has died
+            self._mark_dead(f"Shard {self.shard_id} stopped ({e})")
+        return future
+
+    def _read_loop(self):
+        while True:
+            try:
+                seq, status, result = self.conn.recv()
+            except (EOFError, OSError):
+                break
+            with self.pending_lock:
+                future = self.pending.pop(seq, None)
+            if future is None:
+                continue  # Caller already gave up (timeout)
+            if status == "ok":
+                future.set_result(result)
+            else:
+                future.set_exception(RuntimeError(f"Shard {self.shard_id}: {result}"))
+        # Shard is gone: fail everything still waiting and refuse new requests
+        self._mark_dead(f"Shard {self.shard_id} stopped")
+
+    def _mark_dead(self, reason):
+        with self.pending_lock:
+            self.alive = False
+            pending = list(self.pending.values())
+            self.pending.clear()
+        for future in pending:
+            if not future.done():
+                future.set_exception(RuntimeError(reason))
+
+    def forget(self, future):
+        # Drop a timed-out request so its late reply is discarded
+        with self.pending_lock:
+            for seq, pending in list(self.pending.items()):
+                if pending is future:
+                    del self.pending[seq]
+
+
+class ShardedIndex:
+    def __init__(self, dim, num_shards=2, timeout=2.0, threads_per_shard=1):
+        """
+        Args:
+            dim: Embedding dimension
+            num_shards: Number of worker processes
+            timeout: Seconds to wait for each shard during search
+            threads_per_shard: FAISS OpenMP threads inside each worker
+        """
+        self.dim = dim
+        self.num_shards = num_shards
+        self.timeout = timeout
+        ctx = mp.get_context("spawn")  # Safe with torch / OpenMP threads in the parent
+        self.shards = [_ShardClient(ctx, i, dim, threads_per_shard) for i in range(num_shards)]
+        self.lock = threading.Lock()
+        self.next_id = 0
+        self.documents = {}     # doc_key -> (shard_id, first_global_id, count)
+        self.segment_starts = []  # Sorted first global id of every document
+        self.segment_keys = []    # doc_key for each entry of segment_starts
+
+    def shard_for(self, doc_key):
+        # Document-hash placement: the same document always lands on the same shard
+        return int(hashlib.sha1(doc_key.encode("utf-8")).hexdigest()[:8], 16) % self.num_shards
+
+    def add(self, doc_key, vectors):
+        """
+        Add all chunk vectors of one document to its shard
+        Args:
+            doc_key: Document key (e.g. content hash)
+            vectors: float32 array (num_chunks, dim), row i = chunk i of the document
+        Returns:
+            First global id; chunk i of the document has global id first + i
+        Raises RuntimeError if the shard fails or does not confirm within the timeout
+        (nothing is recorded for the document in that case).
+        """
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        shard_id = self.shard_for(doc_key)
+        with self.lock:
+            if doc_key in self.documents:
+                return self.documents[doc_key][1]
+            # Reserve the id range now (ids are never reused, even if the add fails)
+            first = self.next_id
+            self.next_id += len(vectors)
+
+        shard = self.shards[shard_id]
+        ids = np.arange(first, first + len(vectors), dtype=np.int64)
+        future = shard.request("add", (ids, vectors))
+        try:
+            future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            # The shard may still apply the add later; requests are handled in
+            # order, so queueing a remove right behind it undoes that
+            shard.forget(future)
+            shard.request("remove", ids)
+            raise RuntimeError(f"Shard {shard_id} did not confirm adding {doc_key[:12]} "
+                               f"within {self.timeout}s")
+
+        # Only documents the shard actually holds become visible to locate()
+        with self.lock:
+            existing = self.documents.get(doc_key)
+            if existing is None:
+                self.documents[doc_key] = (shard_id, first, len(vectors))
+                position = bisect.bisect(self.segment_starts, first)
+                self.segment_starts.insert(position, first)
+                self.segment_keys.insert(position, doc_key)
+        if existing is not None:
+            # A concurrent add of the same document won: drop this copy
+            shard.request("remove", ids)
+            return existing[1]
+        return first
+
+    def remove(self, doc_key):
+        """
+        Drop a document's vectors from its shard
+        The document disappears from search results right away; if the shard
+        fails or times out, its orphaned vectors are only reported (their ids
+        are never reused and locate() no longer maps them to a document).
+        """
+        with self.lock:
+            entry = self.documents.pop(doc_key, None)
+            if entry is None:
+                return
+            position = self.segment_keys.index(doc_key)
+            del self.segment_starts[position]
+            del self.segment_keys[position]
+        shard_id, first, count = entry
+        ids = np.arange(first, first + count, dtype=np.int64)
+        shard = self.shards[shard_id]
+        future = shard.request("remove", ids)
+        try:
+            future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            shard.forget(future)
+            print(f"⚠️ Shard {shard_id} did not confirm removing {doc_key[:12]} within {self.timeout}s")
+        except RuntimeError as e:
+            print(f"⚠️ {e}")
+
+    def locate(self, global_id):
+        """Map a global id back to (doc_key, chunk_id within the document)"""
+        with self.lock:
+            position = bisect.bisect_right(self.segment_starts, global_id) - 1
+            if position < 0:
+                return None, -1
+            doc_key = self.segment_keys[position]
+            _, first, count = self.documents[doc_key]
+        if global_id >= first + count:
+            return None, -1
+        return doc_key, int(global_id - first)
+
+    def search(self, queries, k=10):
+        """
+        Scatter the queries to every shard and merge a global top-k
+        Each shard has self.timeout seconds from when its request was sent.
+        Args:
+            queries: float32 array (num_queries, dim)
+            k: Results per query
+        Returns:
+            Tuple: (distances, global_ids, status)
+            distances / global_ids are (num_queries, k), padded with inf / -1;
+            status lists the shards that answered, timed out or failed for this search
+        """
+        queries = np.ascontiguousarray(queries, dtype="float32")
+        if queries.ndim == 1:
+            queries = queries[None, :]
+
+        # Scatter, remembering when each shard got its request
+        requests = []
+        for shard in self.shards:
+            sent_at = time.time()
+            requests.append((shard, shard.request("search", (queries, k)), sent_at))
+
+        # Gather, each shard gets its own timeout counted from its own send time
+        all_distances, all_ids = [], []
+        answered, timed_out, failed = [], [], []
+        for shard, future, sent_at in requests:
+            remaining = max(sent_at + self.timeout - time.time(), 0.0)
+            try:
+                result = future.result(timeout=remaining)
+            except FutureTimeoutError:
+                shard.forget(future)
+                timed_out.append(shard.shard_id)
+                continue
+            except RuntimeError as e:
+                print(f"⚠️ {e}")
+                failed.append(shard.shard_id)
+                continue
+            answered.append(shard.shard_id)
+            if result is not None:
+                all_distances.append(result[0])
+                all_ids.append(result[1])
+        status = {"answered": answered, "timed_out": timed_out, "failed": failed,
+                  "partial": bool(timed_out or failed)}
+
+        distances = np.full((len(queries), k), np.inf, dtype="float32")
+        ids = np.full((len(queries), k), -1, dtype=np.int64)
+        if not all_distances:
+            return distances, ids, status
+
+        # Merge: smallest L2 distances across shards
+        merged_distances = np.hstack(all_distances)
+        merged_ids = np.hstack(all_ids)
+        merged_distances[merged_ids < 0] = np.inf
+        order = np.argsort(merged_distances, axis=1, kind="stable")[:, :k]
+        take = order.shape[1]
+        distances[:, :take] = np.take_along_axis(merged_distances, order, axis=1)
+        ids[:, :take] = np.take_along_axis(merged_ids, order, axis=1)
+        ids[~np.isfinite(distances)] = -1
+        return distances, ids, status
+
+    def sizes(self):
+        # Number of vectors held by each shard
+        return [shard.request("size").result(timeout=self.timeout) for shard in self.shards]
+
+    def close(self):
+        for shard in self.shards:
+            try:
+                shard.request("close").result(timeout=self.timeout)
+            except Exception:
+                pass
+            shard.process.join(timeout=self.timeout)
+            if shard.process.is_alive():
+                shard.process.terminate()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+def benchmark(shard_counts=(1, 2, 4), num_vectors=200000, dim=384, num_docs=200,
+              num_queries=2000, k=10, batch_size=8, concurrency=8):
+    """
+    Measure search throughput for different shard counts on random data
+    Returns:
+        List of dicts with shards, queries/sec and p99 latency
+    """
+    rng = np.random.default_rng(0)
+    vectors = rng.random((num_vectors, dim), dtype=np.float32)
+    queries = rng.random((num_queries, dim), dtype=np.float32)
+    doc_slices = np.array_split(np.arange(num_vectors), num_docs)
+    batches = [queries[i:i + batch_size] for i in range(0, num_queries, batch_size)]
+
+    results = []
+    for num_shards in shard_counts:
+        with ShardedIndex(dim, num_shards, timeout=30.0) as index:
+            for doc_number, rows in enumerate(doc_slices):
+                index.add(f"doc-{doc_number}", vectors[rows])
+            index.search(queries[:1], k)  # Warm up every shard
+
+            latencies = []
+
+            def run(batch):
+                start = time.time()
+                index.search(batch, k)
+                latencies.append(time.time() - start)
+
+            start = time.time()
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                list(pool.map(run, batches))
+            elapsed = time.time() - start
+
+        results.append({
+            "shards": num_shards,
+            "queries_per_sec": num_queries / elapsed,
+            "p99_ms": float(np.percentile(latencies, 99) * 1000),
+        })
+        print(f"📊 {num_shards} shard(s): {results[-1]['queries_per_sec']:.0f} queries/s, "
+              f"p99 {results[-1]['p99_ms']:.1f} ms")
+    return results
+
+
+if __name__ == "__main__":
+    # Usage: python -m core.sharded_index [shard counts...]
+    counts = tuple(int(arg) for arg in sys.argv[1:]) or (1, 2, 4)
+    print(f"Benchmarking sharded search on {os.cpu_count()} CPUs")
+    benchmark(counts)
@@ -3,6 +3,8 @@ import os
 import sys
 import uuid
 import time 
+import threading
+from collections import OrderedDict
 
 # Add project root to Python path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
@@ -11,8 +13,15 @@ from agents.Ingestion import IngestionAgent
 from agents.Retreival import RetrievalAgent
 from agents.llm import LLMResponseAgent
 from agents.logging import LoggingAgent 
+from main.index_manager import IndexManager
+from main.profiling import profile_trace
+from core.sharded_index import ShardedIndex
+from core.chunk_metadata import chunk_citation
 from mcp.message_protocol import MCPMessage
 
+# Number of worker processes for the corpus-wide sharded index (0 = disabled)
+RAG_INDEX_SHARDS = int(os.getenv("RAG_INDEX_SHARDS", "0"))
+
 class Coordinator:
     """
     Central coordinator that manages all agents and orchestrates the RAG pipeline
@@ -25,28 +34,148 @@ class Coordinator:
         self.retrieval_agent = RetrievalAgent()      # Finds relevant text chunks
         self.llm_response_agent = LLMResponseAgent() # Generates answers
         self.logging_agent = LoggingAgent()          # Records everything
+        # Per-document indexes shared by all sessions (memory-budgeted, LRU eviction)
+        self.index_manager = IndexManager()
+        # Optional corpus-wide index split across worker processes
+        self.corpus_index = None
+        self.corpus_documents = OrderedDict()  # doc_key -> bytes held in the shards, least recently hit first
+        self.corpus_lock = threading.Lock()
+        if RAG_INDEX_SHARDS > 0:
+            dim = self.retrieval_agent.model.get_sentence_embedding_dimension()
+            self.corpus_index = ShardedIndex(dim, RAG_INDEX_SHARDS)
 
-    def handle_user_query(self, file_path, document_type, user_question, trace_id):
+    def register_document(self, doc_key, document_index):
         """
-        Main pipeline that processes user queries through all agents
+        Make a freshly built index available for questions
+        Args:
+            doc_key: Document key (content hash)
+            document_index: DocumentIndex returned by ingest_document
+        """
+        self.index_manager.register(doc_key, document_index)
+        if self.corpus_index is not None and document_index.index is not None:
+            # Flat indexes can hand back their vectors for the shard
+            vectors = document_index.index.reconstruct_n(0, document_index.index.ntotal)
+            try:
+                self.corpus_index.add(doc_key, vectors)
+            except RuntimeError as e:
+                # The document is still answerable on its own, just not through corpus search
+                print(f"⚠️ {doc_key[:12]} not added to the corpus shards: {e}")
+                return
+            with self.corpus_lock:
+                self.corpus_documents[doc_key] = vectors.nbytes
+                self.corpus_documents.move_to_end(doc_key)
+            self._enforce_corpus_budget()
+
+    def _enforce_corpus_budget(self):
+        # Shard vectors count toward INDEX_MEMORY_BUDGET_MB like loaded indexes do.
+        # If they alone exceed it, the least recently hit documents leave the shards
+        # (their per-document index stays available for single-document questions).
+        removed = []
+        with self.corpus_lock:
+            corpus_bytes = sum(self.corpus_documents.values())
+            while corpus_bytes > self.index_manager.memory_budget_bytes and len(self.corpus_documents) > 1:
+                doc_key, nbytes = self.corpus_documents.popitem(last=False)
+                corpus_bytes -= nbytes
+                removed.append(doc_key)
+        for doc_key in removed:
+            self.corpus_index.remove(doc_key)
+            print(f"📤 Removed {doc_key[:12]} from the corpus shards (memory budget)")
+        self.index_manager.set_external_bytes(corpus_bytes)
+
+    def search_corpus(self, user_question, k=10):
+        """
+        Search every registered document at once through the sharded index
+        Returns:
+            Tuple: (results, status, query_timings)
+            results: list of dicts with doc_key, document, chunk_id, text, citation and distance (best first)
+            status: shards that answered / timed out / failed (status["partial"] is True if any missed)
+            query_timings: queue delay / encode time of the query embedding
+        """
+        if self.corpus_index is None:
+            raise RuntimeError("Corpus search is disabled, set RAG_INDEX_SHARDS to enable it")
+
+        query, query_timings = self.retrieval_agent.embed_query(user_question)
+        distances, ids, status = self.corpus_index.search(query, k)
+        if status["partial"]:
+            print(f"⚠️ Partial corpus search: {status}")
+
+        # Group the hits by document so each document is pinned (and reloaded) only once
+        hits_by_document = OrderedDict()
+        for rank, (distance, global_id) in enumerate(zip(distances[0], ids[0])):
+            if global_id < 0:
+                continue
+            doc_key, chunk_id = self.corpus_index.locate(global_id)
+            if doc_key is None or not self.index_manager.has(doc_key):
+                continue
+            hits_by_document.setdefault(doc_key, []).append((rank, chunk_id, float(distance)))
+
+        ranked = []
+        for doc_key, hits in hits_by_document.items():
+            with self.index_manager.use(doc_key) as document_index:
+                chunks = document_index.chunks
+                documents = chunks.table("documents")
+                for rank, chunk_id, distance in hits:
+                    ranked.append((rank, {
+                        "doc_key": doc_key,
+                        "document": documents[0] if documents else doc_key[:12],
+                        "chunk_id": chunk_id,
+                        "text": chunks[chunk_id],
+                        "citation": chunk_citation(chunks, chunk_id),
+                        "distance": distance,
+                    }))
+        results = [result for _, result in sorted(ranked, key=lambda item: item[0])]
+
+        # Documents that keep answering questions stay in the shards longest
+        with self.corpus_lock:
+            for result in results:
+                if result["doc_key"] in self.corpus_documents:
+                    self.corpus_documents.move_to_end(result["doc_key"])
+        return results, status, query_timings
+
+    def answer_corpus_query(self, user_question, trace_id, profile=None):
+        """
+        Answer a question from the best chunks of every registered document
+        (scatter-gather over the sharded corpus index, needs RAG_INDEX_SHARDS)
         Args:
-            file_path: Path to the uploaded document
-            document_type: Type of document (pdf, docx, etc.)
             user_question: The question user wants answered
             trace_id: Unique identifier to track this request
+            profile: True/False to force profiling of this trace (None = RAG_PROFILE setting)
         Returns:
             Tuple: (final_response_message, performance_metrics)
         """
-        
-        # Start total time measurement
-        total_start_time = time.time()
+        with profile_trace(trace_id, profile) as profiler:
+            return self._answer_query(None, "all documents", "corpus", user_question, trace_id, None, profiler)
+
+    def _retrieve_corpus(self, retrieval_msg):
+        # Corpus-wide counterpart of RetrievalAgent.handle_query
+        query = retrieval_msg.payload["query"]
+        hits, status, query_timings = self.search_corpus(query)
+        results = [hit["text"] for hit in hits]
+        citations = [f"{hit['document']}, {hit['citation']}" if hit["citation"] else hit["document"] for hit in hits]
+        response = self.retrieval_agent.build_response(retrieval_msg.trace_id, query, results, citations,
+                                                       query_timings)
+        return response, status
+
+    def ingest_document(self, file_path, document_type, trace_id, output_folder="extracted_data", progress=None,
+                        profile=None):
+        """
+        Parse a document and build its searchable index (no question needed)
+        Args:
+            file_path: Path to the uploaded document
+            document_type: Type of document (pdf, docx, etc.)
+            trace_id: Unique identifier to track this request
+            output_folder: Where extracted text/images are written
+            progress: Optional callback progress(stage, done, total)
+            profile: True/False to force profiling of this trace (None = RAG_PROFILE setting)
+        Returns:
+            Tuple: (DocumentIndex, performance_metrics)
+        """
+        with profile_trace(trace_id, profile) as profiler:
+            return self._ingest_document(file_path, document_type, trace_id, output_folder, progress, profiler)
+
+    def _ingest_document(self, file_path, document_type, trace_id, output_folder, progress, profiler):
         performance_metrics = {}
-        
-        # STEP 1: Send document to Ingestion Agent for processing
-        print("\n" + "="*60)
-        print("⏱️  PERFORMANCE TRACKING")
-        print("="*60)
-        
+
         # Create message for document upload
         ingestion_msg = MCPMessage(
             sender="UI",                        # Message comes from user interface
@@ -60,42 +189,93 @@ class Coordinator:
         )
         print(f"\n[{ingestion_msg.sender} ➜ {ingestion_msg.receiver}] {ingestion_msg.to_dict()}")
 
-        # Measure ingestion time
+        # Measure ingestion time (text/image extraction)
         ingestion_start = time.time()
-        ingestion_response = self.ingestion_agent.handle_document(file_path, document_type, trace_id)
+        with profiler.stage("ingestion"):
+            ingestion_response = self.ingestion_agent.handle_document(
+                file_path, document_type, trace_id, output_folder, progress
+            )
         ingestion_time = time.time() - ingestion_start
         performance_metrics['ingestion_time'] = ingestion_time
         print(f"✅ Ingestion completed in {ingestion_time:.3f}s")
 
-        # STEP 2: Send extracted text to Retrieval Agent for indexing and searching
-        # Create message for retrieval
+        # Measure indexing time (chunking + embeddings + FAISS)
+        indexing_start = time.time()
+        with profiler.stage("indexing"):
+            document_index = self.retrieval_agent.create_index(
+                ingestion_response.payload["text_path"],
+                progress,
+                source_format=document_type,
+                document_name=os.path.basename(file_path),
+            )
+        indexing_time = time.time() - indexing_start
+        performance_metrics['indexing_time'] = indexing_time
+        print(f"✅ Indexing completed in {indexing_time:.3f}s")
+
+        return document_index, performance_metrics
+
+    def answer_query(self, document_index, file_path, document_type, user_question, trace_id, filters=None,
+                     profile=None):
+        """
+        Answer a question against an already built document index
+        Args:
+            document_index: DocumentIndex returned by ingest_document
+            file_path: Path to the uploaded document (for logging)
+            document_type: Type of document (pdf, docx, etc.)
+            user_question: The question user wants answered
+            trace_id: Unique identifier to track this request
+            filters: Optional chunk metadata filters, e.g. {"pages": (10, 40)}
+            profile: True/False to force profiling of this trace (None = RAG_PROFILE setting)
+        Returns:
+            Tuple: (final_response_message, performance_metrics)
+        """
+        with profile_trace(trace_id, profile) as profiler:
+            return self._answer_query(document_index, file_path, document_type, user_question, trace_id,
+                                      filters, profiler)
+
+    def _answer_query(self, document_index, file_path, document_type, user_question, trace_id, filters, profiler):
+        # document_index=None searches every document through the corpus shards
+        total_start_time = time.time()
+        performance_metrics = {}
+
+        # STEP 1: Send the question to the Retrieval Agent for searching
         retrieval_msg = MCPMessage(
-            sender="IngestionAgent",            # Message comes from ingestion
+            sender="Coordinator",               # Message comes from coordinator
             receiver="RetrievalAgent",          # Send to retrieval agent
-            msg_type="DOCUMENT_CHUNKS",         # Type of request
+            msg_type="RETRIEVAL_REQUEST",       # Type of request
             trace_id=trace_id,                  # For tracking
             payload={
-                "text_path": ingestion_response.payload["text_path"],  # Where text was saved
-                "query": user_question          # User's question to search for
+                "query": user_question,         # User's question to search for
+                "filters": filters              # Metadata filters pushed into FAISS
             }
         )
         print(f"\n[{retrieval_msg.sender} ➜ {retrieval_msg.receiver}] {retrieval_msg.to_dict()}")
 
         # Measure retrieval time
         retrieval_start = time.time()
-        retrieval_response = self.retrieval_agent.handle_document(retrieval_msg)
+        with profiler.stage("retrieval"):
+            if document_index is None:
+                retrieval_response, status = self._retrieve_corpus(retrieval_msg)
+                performance_metrics['partial_search'] = status["partial"]
+            else:
+                retrieval_response = self.retrieval_agent.handle_query(retrieval_msg, document_index)
         retrieval_time = time.time() - retrieval_start
         performance_metrics['retrieval_time'] = retrieval_time
+        # Query embedding runs on the batcher thread, so its timings are reported separately
+        # (a profile of this trace only shows the wait for the batch)
+        for name, value in retrieval_response.payload.get("query_timings", {}).items():
+            performance_metrics[f'query_{name}'] = value
         print(f"✅ Retrieval completed in {retrieval_time:.3f}s")
 
-        # STEP 3: Send query and context to LLM Agent for answer generation
+        # STEP 2: Send query and context to LLM Agent for answer generation
         llm_start = time.time()
-        llm_response = self.llm_response_agent.handle_context(retrieval_response)
+        with profiler.stage("llm"):
+            llm_response = self.llm_response_agent.handle_context(retrieval_response)
         llm_time = time.time() - llm_start
         performance_metrics['llm_time'] = llm_time
         print(f"✅ LLM response generated in {llm_time:.3f}s")
 
-        # STEP 4: Log the entire interaction for analysis and debugging
+        # STEP 3: Log the entire interaction for analysis and debugging
         logging_start = time.time()
         log_msg = MCPMessage(
             sender="Coordinator",               # Message comes from coordinator
@@ -112,14 +292,59 @@ class Coordinator:
                 "error": ""                                                # No error message
             }
         )
-        self.logging_agent.handle_log(log_msg)
+        with profiler.stage("logging"):
+            self.logging_agent.handle_log(log_msg)
         logging_time = time.time() - logging_start
         performance_metrics['logging_time'] = logging_time
         print(f"✅ Logging completed in {logging_time:.3f}s")
 
+        performance_metrics['total_time'] = time.time() - total_start_time
+        return llm_response, performance_metrics
+
+    def handle_user_query(self, file_path, document_type, user_question, trace_id, profile=None):
+        """
+        Main pipeline that processes user queries through all agents
+        Args:
+            file_path: Path to the uploaded document
+            document_type: Type of document (pdf, docx, etc.)
+            user_question: The question user wants answered
+            trace_id: Unique identifier to track this request
+            profile: True/False to force profiling of this trace (None = RAG_PROFILE setting)
+        Returns:
+            Tuple: (final_response_message, performance_metrics)
+        """
+        with profile_trace(trace_id, profile) as profiler:
+            return self._handle_user_query(file_path, document_type, user_question, trace_id, profiler)
+
+    def _handle_user_query(self, file_path, document_type, user_question, trace_id, profiler):
+        # Start total time measurement
+        total_start_time = time.time()
+        
+        print("\n" + "="*60)
+        print("⏱️  PERFORMANCE TRACKING")
+        print("="*60)
+
+        # STEP 1: Parse the document and build its index
+        document_index, ingestion_metrics = self._ingest_document(
+            file_path, document_type, trace_id, "extracted_data", None, profiler
+        )
+
+        # STEP 2: Retrieve, generate the answer and log the interaction
+        llm_response, answer_metrics = self._answer_query(
+            document_index, file_path, document_type, user_question, trace_id, None, profiler
+        )
+
+        performance_metrics = {**ingestion_metrics, **answer_metrics}
+        # Indexing is part of retrieval in the summary below
+        performance_metrics['retrieval_time'] += performance_metrics.pop('indexing_time')
+
         # Calculate total time
         total_time = time.time() - total_start_time
         performance_metrics['total_time'] = total_time
+        ingestion_time = performance_metrics['ingestion_time']
+        retrieval_time = performance_metrics['retrieval_time']
+        llm_time = performance_metrics['llm_time']
+        logging_time = performance_metrics['logging_time']
         
         # Print performance summary
         print("\n" + "="*60)
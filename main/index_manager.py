@@ -0,0 +1,209 @@
+#main/index_manager.py
+# Keeps one searchable index per document instead of a single shared index
+# inside RetrievalAgent. Indexes are reference counted while a request uses
+# them; when the memory budget is exceeded, the least recently used idle ones
+# are dropped from RAM and transparently reloaded from disk on next use.
+import os
+import time
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import faiss
+
+from agents.Retreival import DocumentIndex
+from core.chunk_store import ChunkStore
+
+INDEX_MEMORY_BUDGET_MB = int(os.getenv("INDEX_MEMORY_BUDGET_MB", "1024"))
+INDEX_FILE = "index.faiss"
+
+
+class IndexHandle:
+    """Bookkeeping for one document's index (loaded or evicted)"""
+
+    def __init__(self, key, path, chunks_path):
+        self.key = key                    # Document key (content hash)
+        self.path = path                  # Directory holding index.faiss
+        self.chunks_path = chunks_path    # Directory of the ChunkStore
+        self.document_index = None        # DocumentIndex while loaded, None when evicted
+        self.refcount = 0                 # Requests currently using this index
+        self.nbytes = 0                   # Estimated RAM used while loaded
+        self.last_used = time.time()
+        self.load_lock = threading.Lock() # Only one thread reloads an evicted index
+
+    @property
+    def loaded(self):
+        return self.document_index is not None
+
+
+def estimate_nbytes(document_index):
+    # Flat FAISS indexes store ntotal * d float32 values; chunks are counted too
+    size = 0
+    if document_index.index is not None:
+        size += document_index.index.ntotal * document_index.index.d * 4
+    if isinstance(document_index.chunks, ChunkStore):
+        size += document_index.chunks.nbytes
+    return size
+
+
+class IndexManager:
+    def __init__(self, spill_dir="index_cache", memory_budget_bytes=None):
+        """
+        Args:
+            spill_dir: Where indexes are persisted so they can be evicted
+            memory_budget_bytes: Total RAM allowed for loaded indexes
+        """
+        self.spill_dir = spill_dir
+        os.makedirs(spill_dir, exist_ok=True)
+        self.memory_budget_bytes = memory_budget_bytes or INDEX_MEMORY_BUDGET_MB * 1024 * 1024
+        self.handles = OrderedDict()   # key -> IndexHandle, least recently used first
+        self.loaded_bytes = 0
+        self.external_bytes = 0        # RAM held elsewhere for these documents (e.g. corpus shards)
+        self.retired = []              # Replaced handles still pinned by a request (still in loaded_bytes)
+        self.lock = threading.Lock()
+        self.evictions = 0
+        self.reloads = 0
+
+    def register(self, key, document_index):
+        """
+        Persist a freshly built index and keep it loaded under the given key
+        Registering an existing key replaces the previous index.
+        """
+        path = os.path.join(self.spill_dir, key[:16])
+        os.makedirs(path, exist_ok=True)
+
+        # Chunk text (and its metadata) must survive eviction and the clean-up of
+        # extracted_data/, so the manager always keeps its own copy under index_cache/
+        chunks = document_index.chunks
+        chunks_path = os.path.join(path, "chunks")
+        if isinstance(chunks, ChunkStore):
+            chunks = chunks.save(chunks_path)
+        else:
+            chunks = ChunkStore.write(chunks_path, chunks)
+        document_index = DocumentIndex(document_index.index, chunks)
+        if document_index.index is not None:
+            faiss.write_index(document_index.index, os.path.join(path, INDEX_FILE))
+
+        handle = IndexHandle(key, path, chunks.path)
+        handle.document_index = document_index
+        handle.nbytes = estimate_nbytes(document_index)
+
+        with self.lock:
+            old = self.handles.pop(key, None)
+            if old is not None and old.loaded:
+                if old.refcount > 0:
+                    # Still pinned by a request: its memory stays counted until release()
+                    self.retired.append(old)
+                else:
+                    self.loaded_bytes -= old.nbytes
+            self.handles[key] = handle
+            self.loaded_bytes += handle.nbytes
+            self._enforce_budget()
+        return handle
+
+    def set_external_bytes(self, nbytes):
+        """
+        Count memory used outside the manager (e.g. sharded corpus vectors) toward
+        the budget, so loaded per-document indexes are evicted to make room for it
+        """
+        with self.lock:
+            self.external_bytes = nbytes
+            self._enforce_budget()
+
+    def has(self, key):
+        with self.lock:
+            return key in self.handles
+
+    def acquire(self, key):
+        """
+        Pin an index for use and return its DocumentIndex (reloading it if evicted)
+        Every acquire() must be paired with release(); prefer use().
+        """
+        return self._pin(key).document_index
+
+    def release(self, key):
+        with self.lock:
+            handle = self.handles.get(key)
+        if handle is not None:
+            self._unpin(handle)
+
+    @contextmanager
+    def use(self, key):
+        # Unpins the exact handle it pinned, even if the key is re-registered meanwhile
+        handle = self._pin(key)
+        try:
+            yield handle.document_index
+        finally:
+            self._unpin(handle)
+
+    def _pin(self, key):
+        with self.lock:
+            handle = self.handles.get(key)
+            if handle is None:
+                raise KeyError(f"No index registered for {key}")
+            handle.refcount += 1
+            handle.last_used = time.time()
+            self.handles.move_to_end(key)  # Most recently used
+
+        try:
+            if not handle.loaded:
+                self._reload(handle)
+        except Exception:
+            self._unpin(handle)
+            raise
+        return handle
+
+    def _unpin(self, handle):
+        with self.lock:
+            if handle.refcount > 0:
+                handle.refcount -= 1
+            if handle.refcount == 0 and handle in self.retired:
+                # Last user of a replaced index is done: its memory can be freed now
+                self.retired.remove(handle)
+                handle.document_index = None
+                self.loaded_bytes -= handle.nbytes
+            self._enforce_budget()
+
+    def _reload(self, handle):
+        with handle.load_lock:
+            if handle.loaded:
+                return  # Another thread reloaded it while we waited
+            index_path = os.path.join(handle.path, INDEX_FILE)
+            index = faiss.read_index(index_path) if os.path.exists(index_path) else None
+            document_index = DocumentIndex(index, ChunkStore.open(handle.chunks_path))
+            nbytes = estimate_nbytes(document_index)
+            with self.lock:
+                handle.document_index = document_index
+                handle.nbytes = nbytes
+                self.loaded_bytes += nbytes
+                self.reloads += 1
+                if self.handles.get(handle.key) is not handle:
+                    self.retired.append(handle)  # Re-registered while reloading, freed by _unpin
+                self._enforce_budget()
+        print(f"♻️ Reloaded index {handle.key[:12]} from disk")
+
+    def _enforce_budget(self):
+        # Caller holds self.lock. Evict idle indexes, least recently used first.
+        if self.loaded_bytes + self.external_bytes <= self.memory_budget_bytes:
+            return
+        for handle in list(self.handles.values()):
+            if self.loaded_bytes + self.external_bytes <= self.memory_budget_bytes:
+                break
+            if handle.loaded and handle.refcount == 0:
+                handle.document_index = None
+                self.loaded_bytes -= handle.nbytes
+                self.evictions += 1
+                print(f"📤 Evicted index {handle.key[:12]} ({handle.nbytes:,} bytes)")
+
+    def stats(self):
+        with self.lock:
+            return {
+                "indexes": len(self.handles),
+                "loaded": sum(1 for h in self.handles.values() if h.loaded),
+                "in_use": sum(1 for h in self.handles.values() if h.refcount > 0),
+                "loaded_bytes": self.loaded_bytes,
+                "external_bytes": self.external_bytes,
+                "memory_budget_bytes": self.memory_budget_bytes,
+                "evictions": self.evictions,
+                "reloads": self.reloads,
+            }
@@ -0,0 +1,160 @@
+#main/ingestion_jobs.py
+# Background ingestion: documents are parsed and indexed as soon as they are
+# uploaded, so questions only wait for whatever work is still left.
+import os
+import time
+import shutil
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class IngestionJob:
+    """State of one background ingestion job (one per unique file content)"""
+
+    def __init__(self, job_id, file_name, file_path, doc_type):
+        self.job_id = job_id          # SHA-256 of the file content
+        self.file_name = file_name    # Original upload name
+        self.file_path = file_path    # Where the bytes were saved
+        self.doc_type = doc_type      # Document type (pdf, docx, etc.)
+        self.stage = "queued"         # queued -> parsing -> embedding -> ready / failed
+        self.pages_parsed = 0
+        self.pages_total = 0
+        self.chunks_embedded = 0
+        self.chunks_total = 0
+        self.error = ""
+        self.submitted_at = time.time()
+        self.finished_at = None
+        self.metrics = {}             # Ingestion/indexing timings
+        self.future = None            # concurrent.futures.Future of the job
+
+    def to_dict(self):
+        # Snapshot for the status API (no index / future objects)
+        return {
+            "job_id": self.job_id,
+            "file_name": self.file_name,
+            "doc_type": self.doc_type,
+            "stage": self.stage,
+            "pages_parsed": self.pages_parsed,
+            "pages_total": self.pages_total,
+            "chunks_embedded": self.chunks_embedded,
+            "chunks_total": self.chunks_total,
+            "error": self.error,
+            "elapsed": (self.finished_at or time.time()) - self.submitted_at,
+            "metrics": dict(self.metrics),
+        }
+
+
+class IngestionJobManager:
+    """
+    Runs document ingestion in background threads, deduplicated by content hash
+    Each unique file is parsed and indexed exactly once; later uploads of the
+    same bytes (or Streamlit reruns) return the existing job, unless it failed.
+    """
+
+    def __init__(self, coordinator, upload_dir="uploaded_docs", extract_dir="extracted_data", max_workers=2):
+        self.coordinator = coordinator
+        self.upload_dir = upload_dir
+        self.extract_dir = extract_dir
+        os.makedirs(upload_dir, exist_ok=True)
+        os.makedirs(extract_dir, exist_ok=True)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingestion")
+        self.jobs = {}                 # job_id -> IngestionJob
+        self.lock = threading.Lock()   # Guards self.jobs and job progress fields
+
+    @staticmethod
+    def content_hash(file_bytes):
+        return hashlib.sha256(file_bytes).hexdigest()
+
+    def submit(self, file_bytes, file_name, doc_type):
+        """
+        Start ingesting a document unless the same content is already known
+        Args:
+            file_bytes: Raw uploaded bytes
+            file_name: Original file name
+            doc_type: Type of document (pdf, docx, etc.)
+        Returns:
+            job_id (content hash)
+        """
+        job_id = self.content_hash(file_bytes)
+        with self.lock:
+            existing = self.jobs.get(job_id)
+            if existing is not None and existing.stage != "failed":
+                return job_id
+            # A failed job is replaced by a fresh one so the upload can be retried
+
+            # Prefix with the hash so different files with the same name never collide
+            file_path = os.path.join(self.upload_dir, f"{job_id[:12]}_{file_name}")
+            if not os.path.exists(file_path):
+                with open(file_path, "wb") as f:
+                    f.write(file_bytes)
+
+            job = IngestionJob(job_id, file_name, file_path, doc_type)
+            self.jobs[job_id] = job
+            job.future = self.executor.submit(self._run, job)
+        print(f"📥 Ingestion job {job_id[:12]} queued for {file_name}")
+        return job_id
+
+    def _run(self, job):
+        def progress(stage, done, total):
+            # Called from the parser / encoder while the job runs
+            with self.lock:
+                job.stage = stage
+                if stage == "parsing":
+                    job.pages_parsed, job.pages_total = done, total
+                elif stage == "embedding":
+                    job.chunks_embedded, job.chunks_total = done, total
+
+        output_folder = os.path.join(self.extract_dir, job.job_id[:16])
+        try:
+            with self.lock:
+                job.stage = "parsing"
+            document_index, metrics = self.coordinator.ingest_document(
+                job.file_path,
+                job.doc_type,
+                trace_id=f"ingest-{job.job_id[:12]}",
+                output_folder=output_folder,
+                progress=progress,
+            )
+            # Hand the index to the coordinator (index manager + corpus shards), keyed by content hash
+            self.coordinator.register_document(job.job_id, document_index)
+            with self.lock:
+                job.metrics = metrics
+                job.stage = "ready"
+            return job.job_id
+        except Exception as e:
+            with self.lock:
+                job.stage = "failed"
+                job.error = str(e)
+            print(f"❌ Ingestion job {job.job_id[:12]} failed: {e}")
+            raise
+        finally:
+            # The index manager keeps its own copy of the chunk store in index_cache/,
+            # so the extracted text, images and store are no longer needed
+            shutil.rmtree(output_folder, ignore_errors=True)
+            with self.lock:
+                job.finished_at = time.time()
+
+    def get_job(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is None:
+            raise KeyError(f"Unknown ingestion job: {job_id}")
+        return job
+
+    def get_status(self, job_id):
+        """Return a progress snapshot of a job (see IngestionJob.to_dict)"""
+        job = self.get_job(job_id)
+        with self.lock:
+            return job.to_dict()
+
+    def is_ready(self, job_id):
+        return self.get_status(job_id)["stage"] == "ready"
+
+    def wait(self, job_id, timeout=None):
+        """
+        Block until the job is finished and return the index key
+        (use coordinator.index_manager.use(key) to search it)
+        Raises the job's exception if ingestion failed.
+        """
+        return self.get_job(job_id).future.result(timeout=timeout)
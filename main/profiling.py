@@ -0,0 +1,180 @@
+#main/profiling.py
+# Opt-in profiling of a single trace's path through the agents.
+#
+# Enable with environment variables (or profile=True on a single request,
+# which samples CPU but only traces memory when RAG_PROFILE_MEMORY=1):
+#   RAG_PROFILE=sample        low-overhead stack sampling (safe for production)
+#   RAG_PROFILE=cprofile      deterministic cProfile (higher overhead, debugging only)
+#   RAG_PROFILE_RATE=0.01     fraction of traces to profile (default 1.0)
+#   RAG_PROFILE_INTERVAL_MS=10  sampling interval
+#   RAG_PROFILE_MEMORY=1      also record peak allocations with tracemalloc
+#
+# Output goes to logs/profiles/<trace_id>.*:
+#   .collapsed  folded stacks for flamegraph.pl / speedscope (sample mode)
+#   .pstats     cProfile stats for snakeviz / flameprof (cprofile mode)
+#   .mem.txt    peak traced memory and top allocation sites
+import os
+import sys
+import time
+import random
+import cProfile
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+
+RAG_PROFILE = os.getenv("RAG_PROFILE", "").lower()
+RAG_PROFILE_RATE = float(os.getenv("RAG_PROFILE_RATE", "1.0"))
+RAG_PROFILE_INTERVAL_MS = float(os.getenv("RAG_PROFILE_INTERVAL_MS", "10"))
+RAG_PROFILE_MEMORY = os.getenv("RAG_PROFILE_MEMORY", "0") == "1"
+
+PROFILE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "logs", "profiles"))
+
+# tracemalloc is process wide, so only one trace records memory at a time
+_memory_lock = threading.Lock()
+
+
+class TraceProfiler:
+    """
+    Profiles the calling thread while one trace runs
+    Usage:
+        with TraceProfiler(trace_id, mode="sample") as profiler:
+            with profiler.stage("retrieval"):
+                ...
+    A profiler created with mode=None does nothing.
+    """
+
+    def __init__(self, trace_id, mode=None, memory=False, interval_ms=None, output_dir=PROFILE_DIR):
+        self.trace_id = trace_id
+        self.mode = mode                  # None, "sample" or "cprofile"
+        self.memory = memory              # Record tracemalloc peak / top allocations
+        self.interval = (interval_ms or RAG_PROFILE_INTERVAL_MS) / 1000.0
+        self.output_dir = output_dir
+        self.output_files = []            # Written after the trace finishes
+        self.current_stage = "trace"      # Root frame of sampled stacks
+        self.samples = Counter()          # Folded stack -> sample count
+        self._profile = None
+        self._sampler = None
+        self._stop = threading.Event()
+        self._thread_id = None
+        self._owns_memory = False
+        self._started_tracemalloc = False
+        self._start_time = None
+
+    @property
+    def enabled(self):
+        return self.mode in ("sample", "cprofile") or self.memory
+
+    def __enter__(self):
+        if not self.enabled:
+            return self
+        self._thread_id = threading.get_ident()
+        self._start_time = time.time()
+
+        if self.memory and _memory_lock.acquire(blocking=False):
+            self._owns_memory = True
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(10)  # Keep 10 frames per allocation
+                self._started_tracemalloc = True
+            tracemalloc.reset_peak()
+
+        if self.mode == "cprofile":
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        elif self.mode == "sample":
+            self._sampler = threading.Thread(target=self._sample_loop, name=f"profiler-{self.trace_id}", daemon=True)
+            self._sampler.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if not self.enabled:
+            return False
+        if self._profile is not None:
+            self._profile.disable()
+        if self._sampler is not None:
+            self._stop.set()
+            self._sampler.join()
+        try:
+            self._write_reports()
+        finally:
+            if self._owns_memory:
+                if self._started_tracemalloc:
+                    tracemalloc.stop()
+                _memory_lock.release()
+        return False
+
+    @contextmanager
+    def stage(self, name):
+        # Label samples taken during this block (e.g. "ingestion", "llm")
+        previous = self.current_stage
+        self.current_stage = name
+        try:
+            yield
+        finally:
+            self.current_stage = previous
+
+    def _sample_loop(self):
+        # Periodically capture the profiled thread's stack (other threads are untouched)
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            stack.append(self.current_stage)
+            self.samples[";".join(reversed(stack))] += 1
+
+    def _write_reports(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        base = os.path.join(self.output_dir, str(self.trace_id))
+
+        if self._profile is not None:
+            self._profile.dump_stats(f"{base}.pstats")
+            self.output_files.append(f"{base}.pstats")
+
+        if self._sampler is not None:
+            with open(f"{base}.collapsed", "w", encoding="utf-8") as f:
+                for stack, count in self.samples.items():
+                    f.write(f"{stack} {count}\n")
+            self.output_files.append(f"{base}.collapsed")
+
+        if self._owns_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            top_stats = tracemalloc.take_snapshot().statistics("lineno")[:25]
+            with open(f"{base}.mem.txt", "w", encoding="utf-8") as f:
+                f.write(f"trace_id: {self.trace_id}\n")
+                f.write(f"duration_s: {time.time() - self._start_time:.3f}\n")
+                f.write(f"peak_traced_bytes: {peak}\n")
+                f.write(f"current_traced_bytes: {current}\n")
+                f.write("note: tracemalloc is process wide, concurrent requests are included\n\n")
+                f.write("Top allocation sites:\n")
+                for stat in top_stats:
+                    f.write(f"{stat}\n")
+            self.output_files.append(f"{base}.mem.txt")
+
+        print(f"🧪 Profile for {self.trace_id} written to: {', '.join(self.output_files)}")
+
+
+def profile_trace(trace_id, profile=None):
+    """
+    Create the profiler for one trace
+    Args:
+        trace_id: Unique identifier of the request
+        profile: True/False to force profiling on/off for this request,
+                 None to follow RAG_PROFILE / RAG_PROFILE_RATE
+    Returns:
+        TraceProfiler (a no-op one when profiling is off)
+    """
+    if profile is False:
+        return TraceProfiler(trace_id)
+    if profile is None:
+        if not (RAG_PROFILE or RAG_PROFILE_MEMORY) or random.random() >= RAG_PROFILE_RATE:
+            return TraceProfiler(trace_id)
+        return TraceProfiler(trace_id, RAG_PROFILE or None, RAG_PROFILE_MEMORY)
+    # Explicit per-request flag: use the configured mode, sampling by default.
+    # tracemalloc slows down every request in the process, so memory tracing
+    # stays an operator decision (RAG_PROFILE_MEMORY) even here.
+    return TraceProfiler(trace_id, RAG_PROFILE or "sample", RAG_PROFILE_MEMORY)
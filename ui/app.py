@@ -2,7 +2,7 @@
 import streamlit as st
 import os
 import uuid
-import shutil
+import time
 import sys
 
 # Add the parent directory to Python path so we can import our agents
@@ -10,6 +10,8 @@ import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
 from main.coordinator import Coordinator
+from main.ingestion_jobs import IngestionJobManager
+from core.chunk_metadata import select_chunk_ids
 
 # Create necessary directories for file storage
 UPLOAD_DIR = "uploaded_docs"    # Where user uploads are stored
@@ -20,8 +22,18 @@ os.makedirs(EXTRACT_DIR, exist_ok=True)
 # Configure Streamlit page settings
 st.set_page_config(page_title="Agentic RAG Chatbot", layout="wide")
 
-# Initialize the coordinator (our main orchestrator)
-coordinator = Coordinator()
+# Initialize the coordinator (our main orchestrator) and the background
+# ingestion jobs once per server process, not on every script rerun
+@st.cache_resource
+def get_coordinator():
+    return Coordinator()
+
+@st.cache_resource
+def get_job_manager():
+    return IngestionJobManager(get_coordinator(), UPLOAD_DIR, EXTRACT_DIR)
+
+coordinator = get_coordinator()
+job_manager = get_job_manager()
 
 # Initialize session state variables to persist data across page reloads
 # Session state keeps data alive while user interacts with the app
@@ -31,6 +43,10 @@ if "chat_history" not in st.session_state:
     st.session_state.chat_history = []       # Store Q&A history
 if "questions_asked" not in st.session_state:
     st.session_state.questions_asked = 0     # Count total questions
+if "job_id" not in st.session_state:
+    st.session_state.job_id = None           # Background ingestion job of current file
+if "upload_jobs" not in st.session_state:
+    st.session_state.upload_jobs = {}        # Streamlit file_id -> ingestion job_id
 
 # Create sidebar for system status and statistics
 with st.sidebar:
@@ -43,6 +59,17 @@ with st.sidebar:
         st.success(f"📋 {st.session_state.file_uploaded}")
     else:
         st.info("No document uploaded")
+
+    # Optional page/slide/row range, pushed down into the vector search
+    page_filter = st.text_input("🔎 Limit search to pages / slides / rows", placeholder="e.g. 10-40")
+
+    # Search every uploaded document at once through the sharded corpus index (RAG_INDEX_SHARDS)
+    search_all = False
+    if coordinator.corpus_index is not None:
+        search_all = st.checkbox("📚 Search all uploaded documents")
+
+    # Per-request profiling (CPU samples written to logs/profiles/, plus peak memory if RAG_PROFILE_MEMORY=1)
+    profile_requests = st.checkbox("🧪 Profile my questions")
     
     st.markdown("---")  # Separator line
     
@@ -74,6 +101,16 @@ with st.sidebar:
         st.metric("Characters in Memory", f"{total_chars:,}")
     else:
         st.info("No data in memory")
+    index_stats = coordinator.index_manager.stats()
+    st.caption(f"Indexes loaded: {index_stats['loaded']}/{index_stats['indexes']} "
+               f"({index_stats['loaded_bytes'] / 1e6:.1f} MB of {index_stats['memory_budget_bytes'] / 1e6:.0f} MB)")
+    if coordinator.corpus_index is not None:
+        st.caption(f"Corpus shards: {len(coordinator.corpus_documents)} documents "
+                   f"({index_stats['external_bytes'] / 1e6:.1f} MB)")
+    batch_stats = coordinator.retrieval_agent.query_batcher.stats()
+    if batch_stats["batches"]:
+        st.caption(f"Query batching: {batch_stats['mean_batch_size']:.1f} queries/batch, "
+                   f"p99 queue delay {batch_stats['queue_delay_p99_ms']:.1f} ms")
 
 # Main content area
 st.title("🤖 Agentic RAG Chatbot - Multi-Format Document QA")
@@ -84,22 +121,58 @@ uploaded_file = st.file_uploader(
     type=["pdf", "docx", "pptx", "csv", "xlsx", "txt", "jpg", "png", "jpeg"]
 )
 
-# Handle file upload
-if uploaded_file:
-    # Save uploaded file to disk so our agents can process it
-    file_path = os.path.join(UPLOAD_DIR, uploaded_file.name)
-    with open(file_path, "wb") as f:
-        f.write(uploaded_file.getbuffer())  # Write file bytes to disk
+def render_job_status(placeholder, status):
+    # Show per-stage progress of the background ingestion job
+    with placeholder.container():
+        if status["stage"] == "ready":
+            st.success(f"✅ `{status['file_name']}` is indexed ({status['chunks_total']} chunks)")
+        elif status["stage"] == "failed":
+            st.error(f"❌ Processing failed: {status['error']}")
+        elif status["stage"] == "embedding" and status["chunks_total"]:
+            st.progress(status["chunks_embedded"] / status["chunks_total"],
+                        text=f"🧮 Embedding chunks {status['chunks_embedded']}/{status['chunks_total']}")
+        elif status["stage"] == "parsing" and status["pages_total"]:
+            st.progress(status["pages_parsed"] / status["pages_total"],
+                        text=f"📄 Parsing pages {status['pages_parsed']}/{status['pages_total']}")
+        else:
+            st.info("⏳ Processing document...")
 
-    # Extract file extension for processing (remove the dot)
-    ext = os.path.splitext(file_path)[-1].lower().replace(".", "")
-    
-    # Generate unique trace ID for this session
-    trace_id = str(uuid.uuid4())
+# Which unit a range filter refers to for each document type
+RANGE_FILTER_KEYS = {"pdf": "pages", "pptx": "slides", "csv": "rows"}
+
+def parse_range_filter(text, doc_type):
+    """
+    Turn the sidebar range into a metadata filter for this document type
+    e.g. "10-40" on a PDF -> {"pages": (10, 40)}, "4" on a PPTX -> {"slides": (4, 4)}
+    Returns:
+        Filter dict, or None when no range was typed
+    Raises ValueError with a message for the user if the range cannot be used.
+    """
+    text = (text or "").strip()
+    if not text:
+        return None
+    key = RANGE_FILTER_KEYS.get(doc_type)
+    if key is None:
+        raise ValueError(f"Range filters only work for PDF pages, PPTX slides and CSV rows, "
+                         f"not .{doc_type} files")
+    parts = [p.strip() for p in text.split("-")]
+    if len(parts) not in (1, 2) or not all(p.isdigit() for p in parts):
+        raise ValueError(f"Could not read the range '{text}', use e.g. 10-40 or 12")
+    return {key: (int(parts[0]), int(parts[-1]))}
 
-    # Clean up old extracted data to avoid confusion
-    for f in os.listdir(EXTRACT_DIR):
-        os.remove(os.path.join(EXTRACT_DIR, f))
+job_status_placeholder = None
+
+# Handle file upload
+if uploaded_file:
+    # Start background ingestion as soon as the file lands (once per upload;
+    # identical content is deduplicated by hash inside the job manager)
+    if uploaded_file.file_id not in st.session_state.upload_jobs:
+        ext = os.path.splitext(uploaded_file.name)[-1].lower().replace(".", "")
+        st.session_state.upload_jobs[uploaded_file.file_id] = job_manager.submit(
+            uploaded_file.getvalue(), uploaded_file.name, ext
+        )
+    job_id = st.session_state.upload_jobs[uploaded_file.file_id]
+    st.session_state.job_id = job_id
 
     # Reset chat history if user uploads a new file
     if st.session_state.file_uploaded != uploaded_file.name:
@@ -108,26 +181,81 @@ if uploaded_file:
         st.session_state.questions_asked = 0  # Reset question counter
         st.success(f"✅ Uploaded `{uploaded_file.name}` successfully!")
 
+    # Live ingestion progress
+    job_status_placeholder = st.empty()
+    render_job_status(job_status_placeholder, job_manager.get_status(job_id))
+
     # Chat input box for user questions
     question = st.chat_input("❓ Ask a question about the uploaded document")
 
     # Process user question when submitted
     if question:
-        # Show loading spinner while processing
-        with st.spinner("🔍 Thinking..."):
-            # Send question through the entire RAG pipeline with performance tracking
-            result, metrics = coordinator.handle_user_query(file_path, ext, question, trace_id)
-            
-            # Update statistics
-            st.session_state.questions_asked += 1
+        job = job_manager.get_job(job_id)
+        try:
+            # Wait for the background job if it is still running (never restarts it)
+            wait_start = time.time()
+            with st.spinner("⏳ Waiting for document processing..."):
+                index_key = job_manager.wait(job_id)
+            wait_time = time.time() - wait_start
+        except Exception as e:
+            st.error(f"❌ Document processing failed: {e}")
+            index_key = None
 
-            # Add Q&A to session history for display (including performance metrics)
-            st.session_state.chat_history.append({
-                "question": question,
-                "answer": result.payload["answer"],
-                "sources": result.payload["sources"],  # Context chunks used
-                "metrics": metrics  # Performance data
-            })
+        # Page/slide/row range from the sidebar, in the unit of this document type
+        # (ranges are per document, so they are not used when searching all documents)
+        filters = None
+        if index_key is not None and not search_all:
+            try:
+                filters = parse_range_filter(page_filter, job.doc_type)
+            except ValueError as e:
+                st.warning(f"⚠️ {e}")
+                index_key = None
+
+        if index_key is not None:
+            result = None
+            # Show loading spinner while processing
+            with st.spinner("🔍 Thinking..."):
+                trace_id = str(uuid.uuid4())
+                if search_all:
+                    # Scatter the question to every shard and answer from the best chunks overall
+                    result, metrics = coordinator.answer_corpus_query(
+                        question, trace_id, profile=True if profile_requests else None
+                    )
+                    if metrics.get("partial_search"):
+                        st.warning("⚠️ Some index shards did not answer in time, results may be incomplete")
+                else:
+                    # Pin this document's index for the request (reloaded if it was evicted)
+                    with coordinator.index_manager.use(index_key) as document_index:
+                        # Don't let the LLM answer from an empty context
+                        matching = select_chunk_ids(document_index.chunks, filters)
+                        if matching is not None and len(matching) == 0:
+                            unit, (start, end) = next(iter(filters.items()))
+                            st.warning(f"⚠️ No text found in {unit} {start}-{end} of this document, "
+                                       f"change or clear the range filter")
+                        else:
+                            # Send question through retrieval + LLM with performance tracking
+                            result, metrics = coordinator.answer_query(
+                                document_index, job.file_path, job.doc_type, question, trace_id,
+                                filters=filters,
+                                profile=True if profile_requests else None
+                            )
+
+            if result is not None:
+                # Background ingestion time is reported for reference
+                metrics["ingestion_time"] = job.metrics.get("ingestion_time", 0.0) + job.metrics.get("indexing_time", 0.0)
+                metrics["wait_time"] = wait_time
+
+                # Update statistics
+                st.session_state.questions_asked += 1
+
+                # Add Q&A to session history for display (including performance metrics)
+                st.session_state.chat_history.append({
+                    "question": question,
+                    "answer": result.payload["answer"],
+                    "sources": result.payload["sources"],  # Context chunks used
+                    "citations": result.payload.get("citations", []),  # Page/slide/row of each chunk
+                    "metrics": metrics  # Performance data
+                })
 
 # Display chat history in a conversational format
 if st.session_state.chat_history:
@@ -149,8 +277,10 @@ if st.session_state.chat_history:
                 # Show expandable section with source context
                 with st.expander("📚 Context Used"):
                     # Display each context chunk that was used to generate the answer
-                    for i, chunk in enumerate(msg["sources"], 1):
-                        st.markdown(f"**Chunk {i}:** {chunk}")
+                    citations = msg.get("citations") or [""] * len(msg["sources"])
+                    for i, (chunk, citation) in enumerate(zip(msg["sources"], citations), 1):
+                        label = f"Chunk {i} ({citation})" if citation else f"Chunk {i}"
+                        st.markdown(f"**{label}:** {chunk}")
             
             with col2:
                 # Show performance metrics if available
@@ -158,8 +288,14 @@ if st.session_state.chat_history:
                     with st.expander("⏱️ Performance"):
                         metrics = msg["metrics"]
                         st.metric("Total Time", f"{metrics['total_time']:.2f}s")
-                        st.metric("Ingestion", f"{metrics['ingestion_time']:.2f}s")
+                        st.metric("Ingestion (background)", f"{metrics['ingestion_time']:.2f}s")
+                        if "wait_time" in metrics:
+                            st.metric("Waited for ingestion", f"{metrics['wait_time']:.2f}s")
                         st.metric("Retrieval", f"{metrics['retrieval_time']:.2f}s")
+                        if "query_encode_time" in metrics:
+                            st.metric("Query embedding", f"{metrics['query_encode_time'] * 1000:.1f} ms",
+                                      f"+{metrics['query_queue_delay'] * 1000:.1f} ms queued "
+                                      f"(batch of {metrics['query_batch_size']})", delta_color="off")
                         st.metric("LLM", f"{metrics['llm_time']:.2f}s")
                         st.metric("Logging", f"{metrics['logging_time']:.2f}s")
 else:
@@ -189,3 +325,13 @@ st.markdown(
     """,
     unsafe_allow_html=True  # Allow custom HTML/CSS
 )
+
+# Keep the progress display live until the background job finishes
+if job_status_placeholder is not None and st.session_state.job_id:
+    status = job_manager.get_status(st.session_state.job_id)
+    if status["stage"] not in ("ready", "failed"):
+        while status["stage"] not in ("ready", "failed"):
+            time.sleep(0.5)
+            status = job_manager.get_status(st.session_state.job_id)
+            render_job_status(job_status_placeholder, status)
+        st.rerun()  # Refresh once so the final state is shown everywhere